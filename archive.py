@@ -0,0 +1,183 @@
+"""Packed asset archives.
+
+A chapter's scene files, scripts, images and music are stored back to back
+in one file, so a cold start is one sequential read instead of a seek per
+loose file. Build one with:
+
+    python archive.py build data/01.vnpak data/01/scene.json [--include PATTERN ...]
+    python archive.py list data/01.vnpak
+
+At runtime assets.mount() maps the archive and serves its members to the
+loaders as file-like objects reading straight out of the mapping.
+
+Layout: MAGIC, then the index offset and length as little-endian uint64,
+then the member data, then the index as JSON ({path: [offset, size]}).
+"""
+import argparse
+import glob
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+
+MAGIC = b"VNPAK\x00\x00\x01"
+HEADER = struct.Struct("<8sQQ")
+
+# Members are written in this order so the scene, scripts and opening images come first.
+KIND_ORDER = ("scene", "characters", "backgrounds", "soundtrack", "script", "background", "sprite", "sound", "music")
+
+
+class ArchiveError(ValueError):
+    """Raised for files that are not valid archives."""
+
+
+class MemberFile(io.RawIOBase):
+    """Read-only file object over a slice of an archive mapping."""
+    def __init__(self, view, name):
+        super(MemberFile, self).__init__()
+        self.view = view
+        self.name = name
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.pos + size, len(self.view))
+        data = bytes(self.view[self.pos:end])
+        self.pos = max(self.pos, end)
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, buffer):
+        size = max(0, min(len(buffer), len(self.view) - self.pos))
+        buffer[:size] = self.view[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        if offset < 0:
+            raise ValueError("negative seek position {0}".format(offset))
+        self.pos = offset
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+
+class Archive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as archive_file:
+            self.map = mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self.map, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+            self.map.madvise(mmap.MADV_WILLNEED)  # ask for one read-ahead of the whole file
+
+        try:
+            magic, index_offset, index_size = HEADER.unpack_from(self.map, 0)
+        except struct.error:
+            raise ArchiveError("{0}: truncated header".format(path))
+        if magic != MAGIC:
+            raise ArchiveError("{0}: not an asset archive".format(path))
+        self.index = json.loads(self.map[index_offset:index_offset + index_size].decode("utf-8"))
+        self.view = memoryview(self.map)
+
+    def __contains__(self, path):
+        return normalize_path(path) in self.index
+
+    def read(self, path):
+        """Returns the member's bytes as a memoryview into the mapping (no copy)."""
+        offset, size = self.index[normalize_path(path)]
+        return self.view[offset:offset + size]
+
+    def open(self, path):
+        return MemberFile(self.read(path), path)
+
+    def names(self):
+        return list(self.index)
+
+
+def normalize_path(path):
+    return os.path.normpath(path).replace(os.sep, "/")
+
+
+def build(output, paths):
+    """Writes the files in paths, in order, into a new archive at output."""
+    index = {}
+    temp_path = output + ".tmp"
+    with open(temp_path, "wb") as archive_file:
+        archive_file.write(HEADER.pack(MAGIC, 0, 0))
+        for path in paths:
+            name = normalize_path(path)
+            if name in index:
+                continue
+            with open(path, "rb") as member:
+                data = member.read()
+            index[name] = [archive_file.tell(), len(data)]
+            archive_file.write(data)
+
+        index_data = json.dumps(index, separators=(",", ":")).encode("utf-8")
+        index_offset = archive_file.tell()
+        archive_file.write(index_data)
+        archive_file.seek(0)
+        archive_file.write(HEADER.pack(MAGIC, index_offset, len(index_data)))
+    os.replace(temp_path, output)
+    return index
+
+
+def main(argv=None):
+    import validate
+
+    parser = argparse.ArgumentParser(description="Build or inspect packed asset archives.")
+    commands = parser.add_subparsers(dest="command")
+    build_parser = commands.add_parser("build", help="pack scenes and everything they reference")
+    build_parser.add_argument("output")
+    build_parser.add_argument("scenes", nargs="*", help="scene files whose content is packed")
+    build_parser.add_argument("--include", action="append", default=[],
+                              help="glob of extra files to pack, e.g. 'data/fonts/*'")
+    list_parser = commands.add_parser("list", help="list the members of an archive")
+    list_parser.add_argument("archive")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        archive = Archive(args.archive)
+        for name, (offset, size) in sorted(archive.index.items(), key=lambda item: item[1][0]):
+            print("{0:>10} {1:>10}  {2}".format(offset, size, name))
+        return 0
+
+    if args.command != "build":
+        parser.print_help()
+        return 2
+
+    paths = []
+    if args.scenes:
+        index = validate.validate(args.scenes)
+        if index.errors:
+            for message in index.errors:
+                print("error: " + message)
+            return 1
+        rank = {kind: position for position, kind in enumerate(KIND_ORDER)}
+        paths.extend(sorted(index.assets, key=lambda path: rank.get(index.assets[path], len(rank))))
+    for pattern in args.include:
+        paths.extend(sorted(path for path in glob.glob(pattern) if os.path.isfile(path)))
+    if not paths:
+        parser.error("nothing to pack")
+
+    members = build(args.output, paths)
+    print("{0}: {1} files, {2} bytes".format(args.output, len(members), os.path.getsize(args.output)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+import collections
+import os
+import threading
+import time
+
+import pygame
+
+import archive
+import pixelcache
+import preload
+import profiler
+
+DEFAULT_BUDGET = 256 * 1024 * 1024  # bytes
+
+
+class AssetCache:
+    """Process-wide LRU cache of decoded images and parsed fonts.
+
+    Entries are keyed by path (plus size for fonts) and evicted least recently
+    used first once the estimated memory use goes over the budget. Images
+    predecoded for later count against the same budget and are dropped
+    first, oldest first, since nothing may ever ask for them.
+    """
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        self.used = 0
+
+        self.entries = collections.OrderedDict()  # key -> (asset, cost)
+
+        # Surfaces decoded off the main thread, waiting to be converted on first use.
+        self.decoded = collections.OrderedDict()  # path -> ((surface, translucent), cost), oldest first
+        self.decoded_used = 0
+        self.decoded_lock = threading.Lock()
+
+        self.image_paths = collections.Counter()  # cached variants per image path
+
+        self.hits = 0
+        self.misses = 0
+        self.load_time = 0.0  # seconds spent loading on the calling thread
+
+    def image(self, path, alpha=None, size=None):
+        """Returns the image converted to the display's pixel format.
+
+        alpha=True keeps per-pixel alpha, alpha=False drops it and None keeps it
+        only if the image actually has translucent pixels. With size the image
+        is also scaled once to that size.
+        """
+        key = ("image", path, alpha, size)
+        try:
+            return self._hit(key)
+        except KeyError:
+            pass
+
+        start = time.perf_counter()
+        surface, translucent = self._claim_decoded(path) or decode(path)
+        if alpha is None:
+            alpha = translucent
+        surface = normalize(surface, alpha)
+        if size and surface.get_size() != tuple(size):
+            surface = pygame.transform.smoothscale(surface, size)
+        end = time.perf_counter()
+        self.load_time += end - start
+        profiler.profiler.record("load image", start, end, "asset", {"path": path})
+        self._store(key, surface, surface_cost(surface))
+        return surface
+
+    def font(self, path, size):
+        key = ("font", path, size)
+        try:
+            return self._hit(key)
+        except KeyError:
+            pass
+
+        start = time.perf_counter()
+        font = pygame.font.Font(source(path), size)
+        end = time.perf_counter()
+        self.load_time += end - start
+        profiler.profiler.record("load font", start, end, "asset", {"path": path, "size": size})
+        try:
+            cost = os.path.getsize(path)
+        except (OSError, TypeError):
+            cost = 0  # fonts served from an archive only cost their share of the mapping
+        self._store(key, font, cost)
+        return font
+
+    def predecode(self, path):
+        """Decodes an image without touching the display; safe to call from a worker thread.
+
+        The display-format conversion is left to the next image() call on the main thread.
+        """
+        with self.decoded_lock:
+            if path in self.decoded:
+                return
+        if self.image_paths[path]:
+            return
+        start = time.perf_counter()
+        decoded = decode(path)
+        profiler.profiler.record("predecode image", start, time.perf_counter(), "asset", {"path": path})
+        cost = surface_cost(decoded[0])
+        with self.decoded_lock:
+            if path in self.decoded or self.image_paths[path]:
+                return  # the main thread needed it first and decoded it itself
+            self.decoded[path] = (decoded, cost)
+            self.decoded_used += cost
+            self._evict_decoded()
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self._evict()
+
+    def clear(self):
+        self.entries.clear()
+        self.image_paths.clear()
+        self.used = 0
+        with self.decoded_lock:
+            self.decoded.clear()
+            self.decoded_used = 0
+
+    def _hit(self, key):
+        asset, cost = self.entries[key]
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return asset
+
+    def _store(self, key, asset, cost):
+        self.misses += 1
+        self.entries[key] = (asset, cost)
+        self.used += cost
+        if key[0] == "image":
+            self.image_paths[key[1]] += 1
+            self._claim_decoded(key[1])  # a copy predecoded meanwhile is not needed any more
+        self._evict()
+
+    def _claim_decoded(self, path):
+        """Takes path's predecoded (surface, translucent) out of the waiting list, or returns None."""
+        with self.decoded_lock:
+            entry = self.decoded.pop(path, None)
+            if entry is None:
+                return None
+            self.decoded_used -= entry[1]
+            return entry[0]
+
+    def _evict_decoded(self):
+        # Called with decoded_lock held.
+        while self.decoded and self.used + self.decoded_used > self.budget:
+            path, (decoded, cost) = self.decoded.popitem(last=False)
+            self.decoded_used -= cost
+
+    def _evict(self):
+        with self.decoded_lock:
+            self._evict_decoded()
+        # Never evict the entry that was just stored, even if it alone is over budget.
+        while self.used + self.decoded_used > self.budget and len(self.entries) > 1:
+            key, (asset, cost) = self.entries.popitem(last=False)
+            self.used -= cost
+            if key[0] == "image":
+                self.image_paths[key[1]] -= 1
+
+
+class LazyImage:
+    """Handle to an image that is only decoded the first time it is used."""
+    def __init__(self, path, alpha=None, size=None):
+        self.path = path
+        self.alpha = alpha
+        self.size = size
+
+    def get(self):
+        return cache.image(self.path, self.alpha, self.size)
+
+    def warm(self):
+        """Starts decoding the image on the prefetch thread if it is not cached yet."""
+        if ("image", self.path, self.alpha, self.size) not in cache.entries:
+            preload.prefetcher.run(cache.predecode, self.path)
+
+
+def surface_cost(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+def has_translucency(surface):
+    if not surface.get_flags() & pygame.SRCALPHA:
+        return False
+    opaque = pygame.mask.from_surface(surface, 254).count()
+    return opaque != surface.get_width() * surface.get_height()
+
+
+def colorkey_to_alpha(surface):
+    """Copies a colorkeyed surface (a PNG with a tRNS entry) to one with per-pixel alpha, without the display."""
+    converted = pygame.Surface(surface.get_size(), pygame.SRCALPHA, 32)
+    converted.blit(surface, (0, 0))
+    return converted
+
+
+def decode(path):
+    """Returns (surface, translucent) for path, from the pixel cache when it is up to date.
+
+    Does not touch the display, so it can run on the prefetch thread.
+    """
+    source_stamp = stamp(path)
+    cached = pixelcache.load(path, source_stamp, lambda: open_file(path))
+    if cached is not None:
+        return cached
+    surface = pygame.image.load(source(path), path)
+    if surface.get_colorkey() is not None:
+        surface = colorkey_to_alpha(surface)  # the pixel cache keeps alpha, not colorkeys
+    translucent = has_translucency(surface)
+    pixelcache.store(path, surface, translucent, source_stamp, lambda: open_file(path))
+    return surface, translucent
+
+
+def normalize(surface, alpha=None):
+    """Converts a freshly decoded surface to the display format, with alpha only where needed."""
+    if alpha is None:
+        alpha = has_translucency(surface)
+    if alpha:
+        return surface.convert_alpha()
+    return surface.convert()
+
+
+def is_display_format(surface):
+    """True if blitting surface to the display needs no per-pixel format conversion."""
+    display = pygame.display.get_surface()
+    if display is None:
+        return False
+    return (surface.get_bitsize() == display.get_bitsize()
+            and surface.get_masks()[:3] == display.get_masks()[:3])
+
+
+cache = AssetCache()
+
+archives = []  # mounted archives, searched newest first
+
+
+def mount(path):
+    """Serves every file packed in the archive at path from its memory mapping."""
+    archives.insert(0, archive.Archive(path))
+
+
+def find_archive(path):
+    for mounted in archives:
+        if path in mounted:
+            return mounted
+    return None
+
+
+def source(path):
+    """What to hand to a pygame loader for path: a file object if it is packed, else the path."""
+    mounted = find_archive(path)
+    if mounted is None:
+        return path
+    return mounted.open(path)
+
+
+def stamp(path):
+    """(mtime_ns, size) of path, or of the archive holding it."""
+    mounted = find_archive(path)
+    if mounted is None:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    return os.stat(mounted.path).st_mtime_ns, len(mounted.read(path))
+
+
+def open_file(path):
+    """Opens path for binary reading, from a mounted archive if it is packed there."""
+    mounted = find_archive(path)
+    if mounted is None:
+        return open(path, "rb")
+    return mounted.open(path)
+
+
+def load_image(path, alpha=None, size=None):
+    return cache.image(path, alpha, size)
+
+
+def load_font(path, size):
+    return cache.font(path, size)
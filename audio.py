@@ -0,0 +1,112 @@
+"""Music and sound effects.
+
+Music is streamed through pygame.mixer.music, as before, so a track is never
+decoded as a whole. The look-ahead reads a loose track's compressed bytes on
+the prefetch thread so the "music" action does not wait on the disk. A track
+that has not been read by then is streamed straight from its file; playing
+never waits for the prefetch thread. A new track starts as the old one
+finishes fading out. Short sound effects are decoded once and kept.
+
+Everything is a no-op when the mixer could not be initialized.
+"""
+import collections
+import io
+import os
+import time
+
+import pygame
+
+import assets
+import preload
+import profiler
+
+CROSSFADE_MS = 1500
+MAX_TRACKS = 3  # read-ahead tracks kept in memory, still compressed
+MUSIC_VOLUME = 0.25
+
+
+def decode(path):
+    """Reads and decodes a whole sound file; safe to run on the prefetch thread."""
+    start = time.perf_counter()
+    with assets.open_file(path) as sound_file:
+        sound = pygame.mixer.Sound(file=sound_file)
+    profiler.profiler.record("decode " + path, start, time.perf_counter(), "asset")
+    return sound
+
+
+def read(path):
+    """Reads a track's compressed bytes; safe to run on the prefetch thread."""
+    start = time.perf_counter()
+    with open(path, "rb") as track_file:
+        data = track_file.read()
+    profiler.profiler.record("read " + path, start, time.perf_counter(), "asset")
+    return data
+
+
+class AudioPlayer:
+    def __init__(self):
+        self.tracks = collections.OrderedDict()  # path -> Future of read(path), oldest first
+        self.sounds = {}  # path -> Sound, for effects
+        self.playing = None
+        self.volume = MUSIC_VOLUME
+
+    def ready(self):
+        return bool(pygame.mixer.get_init())
+
+    def preload(self, path):
+        """Starts reading a track that is about to be played.
+
+        Packed tracks are already mapped in memory and are left alone.
+        """
+        if path in self.tracks or path == self.playing or assets.find_archive(path) is not None or not self.ready():
+            return
+        self.tracks[path] = preload.prefetcher.run(read, path)
+        while len(self.tracks) > MAX_TRACKS:
+            self.tracks.popitem(last=False)[1].cancel()
+
+    def stream(self, path):
+        """What to hand to mixer.music for path: its bytes if they were read in time, else its source."""
+        future = self.tracks.pop(path, None)
+        if future is not None and future.done() and not future.cancelled() and future.exception() is None:
+            return io.BytesIO(future.result())
+        if future is not None:
+            future.cancel()
+        return assets.source(path)
+
+    def play_music(self, path, fade_ms=CROSSFADE_MS):
+        """Fades from the current track to path, looping it; a no-op if it is already playing."""
+        if path == self.playing or not self.ready():
+            return
+        stream = self.stream(path)
+        namehint = os.path.splitext(path)[1][1:]
+        if pygame.mixer.music.get_busy():
+            # One stream at a time: the new track is queued to start once this fadeout ends.
+            pygame.mixer.music.fadeout(fade_ms)
+            pygame.mixer.music.queue(stream, namehint, loops=-1)
+        else:
+            pygame.mixer.music.load(stream, namehint)
+            pygame.mixer.music.set_volume(self.volume)
+            pygame.mixer.music.play(loops=-1, fade_ms=fade_ms)
+        self.playing = path
+
+    def stop_music(self, fade_ms=CROSSFADE_MS):
+        if self.ready():
+            pygame.mixer.music.fadeout(fade_ms)  # also drops a queued track
+        self.playing = None
+
+    def play_sound(self, path):
+        """Plays a short effect on any free channel."""
+        if not self.ready():
+            return
+        sound = self.sounds.get(path)
+        if sound is None:
+            sound = self.sounds[path] = decode(path)
+        sound.play()
+
+    def set_volume(self, volume):
+        self.volume = volume
+        if self.ready():
+            pygame.mixer.music.set_volume(volume)
+
+
+player = AudioPlayer()
@@ -0,0 +1,222 @@
+"""Headless playback benchmark.
+
+Plays a scene through scenes.Scene under SDL's dummy video and audio
+drivers, clicking through every line and taking choices from --choices
+(then --seed, or always the first button). Writes JSON with:
+- step times
+- update + get_surface frame time percentiles
+- asset load time
+- peak memory, from one more run that is not timed
+
+    python benchmark.py [data/01/scene.json] [--choices 0,2,1] [--runs 3] [--window 1920x1080] [--output bench.json]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import assets
+import pixelcache
+import preload
+import renderer
+import scenes
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+RES = (1280, 720)
+
+
+def percentiles(samples):
+    """Summary of samples (seconds) in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000.0
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered) * 1000.0,
+        "p50": rank(0.50),
+        "p90": rank(0.90),
+        "p99": rank(0.99),
+        "max": ordered[-1] * 1000.0,
+    }
+
+
+class Player:
+    """Drives a Scene the way a player would, timing every step and frame."""
+    def __init__(self, choices, seed, frames_per_step, dt, max_steps):
+        self.choices = list(choices)
+        self.random = random.Random(seed) if seed is not None else None
+        self.frames_per_step = frames_per_step
+        self.dt = dt
+        self.max_steps = max_steps
+
+        self.step_times = []
+        self.frame_times = []
+        self.scene_load_times = []
+        self.blits = 0
+        self.fast_blits = 0
+        self.taken = []
+        self.ending = None
+
+    def pick(self, buttons):
+        active = [index for index, button in enumerate(buttons) if button.active]
+        if self.choices:
+            index = self.choices.pop(0)
+        elif self.random is not None:
+            index = self.random.choice(active)
+        else:
+            index = active[0]
+        self.taken.append(index)
+        return buttons[index]
+
+    def frames(self, scene):
+        for frame in range(self.frames_per_step):
+            start = time.perf_counter()
+            scene.update(self.dt)
+            scene.get_surface()
+            self.frame_times.append(time.perf_counter() - start)
+            self.blits += scene.renderer.blits
+            self.fast_blits += scene.renderer.fast_blits
+            if not scene.is_animating():
+                break
+
+    def timed(self, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        self.step_times.append(time.perf_counter() - start)
+        return result
+
+    def play(self, source):
+        start = time.perf_counter()
+        scene = scenes.Scene(source)
+        self.scene_load_times.append(time.perf_counter() - start)
+        result = self.timed(scene.step)
+
+        while len(self.step_times) < self.max_steps:
+            end, next_scene = result
+            if end:
+                if next_scene is None:
+                    self.ending = "finished"
+                    return
+                scene = next_scene
+                result = self.timed(scene.step)
+                continue
+
+            self.frames(scene)
+            if scene.choice_point:
+                if not scene.choice_buttons:
+                    self.ending = "stuck at a choice with no buttons"
+                    return
+                button = self.pick(scene.choice_buttons)
+                self.timed(button.press)
+                result = False, None
+            else:
+                if scene.text_box.text_scrolling:
+                    scene.text_box.skip_scroll()
+                result = self.timed(scene.step)
+        self.ending = "max steps reached"
+
+
+def run(source, args):
+    assets.cache.clear()
+    preload.prefetcher.discard()
+    player = Player(args.choices, args.seed, args.frames_per_step, args.dt, args.max_steps)
+    load_time = assets.cache.load_time
+    hits, misses = assets.cache.hits, assets.cache.misses  # the cache counts across runs
+    start = time.perf_counter()
+    player.play(source)
+    wall = time.perf_counter() - start
+
+    return {
+        "wall_s": wall,
+        "steps": len(player.step_times),
+        "choices_taken": player.taken,
+        "ending": player.ending,
+        "scene_load_ms": percentiles(player.scene_load_times),
+        "step_ms": percentiles(player.step_times),
+        "frame_ms": percentiles(player.frame_times),
+        "asset_load_ms": (assets.cache.load_time - load_time) * 1000.0,
+        "asset_cache": {"hits": assets.cache.hits - hits, "misses": assets.cache.misses - misses,
+                        "bytes": assets.cache.used},
+        "blits": player.blits,
+        "fast_path_blits": player.fast_blits,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless scene playback benchmark.")
+    parser.add_argument("scene", nargs="?", default="data/01/scene.json")
+    parser.add_argument("--choices", type=lambda text: [int(index) for index in text.split(",") if index],
+                        default=[], help="comma-separated button indexes to pick at choice points, in order")
+    parser.add_argument("--seed", type=int, default=None, help="pick remaining choices at random with this seed")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--frames-per-step", type=int, default=120, help="most frames rendered per line")
+    parser.add_argument("--dt", type=int, default=16, help="ms passed to update() per frame")
+    parser.add_argument("--max-steps", type=int, default=5000,
+                        help="stop a run after this many steps (a shop can loop forever)")
+    parser.add_argument("--window", type=lambda text: tuple(int(side) for side in text.lower().split("x")),
+                        help="present frames scaled to this WIDTHxHEIGHT instead of 1:1")
+    parser.add_argument("--no-pixel-cache", action="store_true", help="decode every image from its source")
+    parser.add_argument("--output", help="write the results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    pixelcache.enabled = not args.no_pixel_cache
+
+    pygame.init()
+    pygame.display.set_mode(args.window or RES)
+    if args.window:
+        renderer.set_output(RES, args.window)
+
+    with contextlib.redirect_stdout(sys.stderr):  # keep the scene's prints out of the JSON
+        runs = [run(args.scene, args) for index in range(args.runs)]
+        # tracemalloc slows every allocation down, so memory gets a pass of its own whose times are dropped.
+        tracemalloc.start()
+        run(args.scene, args)
+        peak_python = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    results = {
+        "scene": args.scene,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "platform": platform.platform(),
+        "pixel_cache": pixelcache.enabled,
+        "window": args.window or RES,
+        "peak_python_bytes": peak_python,
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        "runs": runs,
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+    preload.prefetcher.shutdown()
+    pygame.quit()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
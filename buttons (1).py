@@ -1,35 +1,125 @@
+import collections
 import pygame
+import assets
+import profiler
 
 white = (255, 255, 255)
 gray = (129, 129, 129)
 black = (0, 0, 0)
+highlight = (255, 225, 120)
+
+HOVER_TINT = (40, 40, 40)  # added to a hovered button's background
+PRESSED_TINT = (200, 200, 200)  # multiplied into a pressed button's background
+
+GRID_CELL = 64  # side of the ButtonGrid squares, in pixels
+
+STATES = ("active", "inactive", "hover", "pressed")
+
+
+class ButtonGrid:
+    """Buckets buttons by the GRID_CELL squares their rects overlap.
+
+    A point is only tested against the buttons sharing its square. The grid
+    also tracks which button is hovered and which is held down. Buttons must
+    not move after they are added.
+    """
+    def __init__(self, buttons=()):
+        self.cells = collections.defaultdict(list)
+        self.hovered = None
+        self.pressed = None
+        for button in buttons:
+            self.add(button)
+
+    def add(self, button):
+        rect = button.rect
+        for x in range(rect.left // GRID_CELL, (rect.right - 1) // GRID_CELL + 1):
+            for y in range(rect.top // GRID_CELL, (rect.bottom - 1) // GRID_CELL + 1):
+                self.cells[(x, y)].append(button)
+
+    def at(self, pos):
+        """The last-added button under pos, or None."""
+        for button in reversed(self.cells.get((int(pos[0]) // GRID_CELL, int(pos[1]) // GRID_CELL), ())):
+            if button.hover(pos):
+                return button
+        return None
+
+    def hover(self, pos):
+        """Moves the hover highlight to the button under pos; returns whether it changed."""
+        button = self.at(pos)
+        if button is self.hovered:
+            return False
+        if self.hovered is not None:
+            self.hovered.hovered = False
+        if button is not None:
+            button.hovered = True
+        self.hovered = button
+        return True
+
+    def press(self, pos):
+        """Presses the button under pos, if any, and returns it."""
+        button = self.at(pos)
+        if button is not None:
+            self.release()
+            button.pressed = True
+            self.pressed = button
+            button.press()
+        return button
+
+    def release(self):
+        if self.pressed is not None:
+            self.pressed.pressed = False
+            self.pressed = None
 
 
 class Menu:
+    """A background image with buttons, composited into a cached surface.
+
+    The surface is only redrawn when a button changes state; version counts
+    the redraws so callers can tell when it has to be presented again.
+    Positions passed in are screen positions.
+    """
     def __init__(self, rect, buttons, image_path):
-        self.image = pygame.image.load(image_path).convert_alpha()
+        self.image = assets.load_image(image_path)
         self.rect = self.image.get_rect()
         self.rect.topleft = rect.topleft
 
+        self.surface = pygame.Surface(self.rect.size).convert_alpha()
+        profiler.profiler.count("surfaces")
+        self.version = 0
+        self.set_buttons(buttons)
+
+    def set_buttons(self, buttons):
         self.buttons = buttons
+        self.grid = ButtonGrid(buttons)
+        self.states = None  # button states the surface was composed with
 
     def update(self, dt):
         for button in self.buttons:
             button.update(dt)
 
     def get_surface(self):
-        return_surface = pygame.Surface(self.rect.size).convert_alpha()
-        return_surface.fill((0, 0, 0, 0))
-        return_surface.blit(self.image, (0, 0))
-        for button in self.buttons:
-            surface, rect = button.get_surface()
-            return_surface.blit(surface, rect)
-        return return_surface, self.rect
+        states = [button.state for button in self.buttons]
+        if states != self.states:
+            self.surface.fill((0, 0, 0, 0))
+            self.surface.blit(self.image, (0, 0))
+            for button in self.buttons:
+                surface, rect = button.get_surface()
+                self.surface.blit(surface, rect)
+            self.states = states
+            self.version += 1
+        return self.surface, self.rect
+
+    def local(self, pos):
+        return pos[0] - self.rect.x, pos[1] - self.rect.y
+
+    def hover(self, pos):
+        return self.grid.hover(self.local(pos))
 
     def click(self, pos):
-        for button in self.buttons:
-            if button.hover(pos):
-                button.press()
+        self.grid.press(self.local(pos))
+
+    def release(self):
+        self.grid.release()
 
 
 class Button:
@@ -37,6 +127,19 @@ class Button:
         self.rect = rect
         self.action = None
         self.active = False
+        self.hovered = False
+        self.pressed = False
+
+    @property
+    def state(self):
+        """Which of STATES the button is drawn in."""
+        if not self.active:
+            return "inactive"
+        if self.pressed:
+            return "pressed"
+        if self.hovered:
+            return "hover"
+        return "active"
 
     def update(self, dt):
         pass
@@ -59,56 +162,70 @@ class Button:
 
 class ImageButton(Button):
     def __init__(self, image_path, inactive_image_path):
-        self.image = pygame.image.load(image_path).convert_alpha()
-        self.inactive_image = pygame.image.load(inactive_image_path).convert_alpha()
+        self.image = assets.load_image(image_path)
+        self.inactive_image = assets.load_image(inactive_image_path)
         assert self.image.get_size() == self.inactive_image.get_size(), "inactive and active image size is different."
 
-        super(ImageButton, self).__init__(self.image.get_rect)
+        super(ImageButton, self).__init__(self.image.get_rect())
 
-        self.surface = pygame.Surface((20, 20))
+        self.surfaces = {
+            "active": self.image,
+            "inactive": self.inactive_image,
+            "hover": tinted(self.image, HOVER_TINT, pygame.BLEND_RGB_ADD),
+            "pressed": tinted(self.image, PRESSED_TINT, pygame.BLEND_RGB_MULT),
+        }
 
         self.active = False
 
     def get_surface(self):
-        if self.active:
-            self.surface.blit(self.image, self.rect)
-        else:
-            self.surface.blit(self.inactive_image, self.rect)
-        return self.surface, self.rect
+        return self.surfaces[self.state], self.rect
 
 
 class TextButton(Button):
-    def __init__(self, text, font, size=22, text_color=white, background_path=None, inactive_color=gray):
-        self.font = pygame.font.Font(font, size)
+    def __init__(self, text, font, size=22, text_color=white, background_path=None, inactive_color=gray,
+                 hover_color=highlight):
+        self.label = text
+        self.font = assets.load_font(font, size)
+        profiler.profiler.count("renders", 3)
         self.text = self.font.render(text, True, text_color)
         self.inactive_text = self.font.render(text, True, inactive_color)
+        self.hover_text = self.font.render(text, True, hover_color)
         if background_path:
-            self.background = pygame.image.load(background_path).convert_alpha()
+            self.background = assets.load_image(background_path)
             super(TextButton, self).__init__(self.background.get_rect())
         else:
             self.background = None
             super(TextButton, self).__init__(self.text.get_rect())
 
-        self.text_rect = self.text.get_rect()
-        self.text_rect.center = self.rect.center
-
-        self.inactive_text_rect = self.inactive_text.get_rect()
-        self.inactive_text_rect.center = self.rect.center
-
-        self.surface = pygame.Surface((self.rect.w, self.rect.h)).convert_alpha()
+        # Every state is drawn once here; get_surface only picks one.
+        self.surfaces = {
+            "active": self.render_state(self.text),
+            "inactive": self.render_state(self.inactive_text),
+            "hover": self.render_state(self.hover_text, HOVER_TINT, pygame.BLEND_RGB_ADD),
+            "pressed": self.render_state(self.hover_text, PRESSED_TINT, pygame.BLEND_RGB_MULT, (1, 1)),
+        }
 
         self.active = False
 
         self.name = ""
 
-    def get_surface(self):
-        self.surface.fill((0, 0, 0, 0))
+    def render_state(self, text, tint=None, blend=0, offset=(0, 0)):
+        surface = pygame.Surface((self.rect.w, self.rect.h)).convert_alpha()
+        profiler.profiler.count("surfaces")
+        surface.fill((0, 0, 0, 0))
         if self.background:
-            self.surface.blit(self.background, (0, 0))
+            surface.blit(tinted(self.background, tint, blend) if tint else self.background, (0, 0))
+        text_rect = text.get_rect()
+        text_rect.center = (self.rect.w // 2 + offset[0], self.rect.h // 2 + offset[1])
+        surface.blit(text, text_rect)
+        return surface
 
-        if self.active:
-            self.surface.blit(self.text, self.text_rect)
-        else:
-            self.surface.blit(self.inactive_text, self.inactive_text_rect)
+    def get_surface(self):
+        return self.surfaces[self.state], self.rect
 
-        return self.surface, self.rect
+
+def tinted(surface, tint, blend):
+    """A copy of surface with tint blended into its colour channels."""
+    result = surface.copy()
+    result.fill(tint, special_flags=blend)
+    return result
@@ -0,0 +1,369 @@
+"""Headless route explorer.
+
+Plays every route through the choices, bchoices and shops of a scene
+under SDL's dummy video driver, without audio, and reports:
+- the endings reached, with the range of every stat at each
+- dead ends (a script running out without an ending, a shop that cannot be left)
+- scripts that no route enters
+- the slowest steps
+
+Routes are split at choice points. A job restores a Scene from the snapshot
+taken when the choice was shown, presses one button and plays on until the
+next choice point or an ending. Choice points are deduplicated by a hash of
+the scene, script file, step index and stats, so routes that meet again are
+only played on once. Pending jobs are taken from a stack, so routes are
+explored depth first, while a multiprocessing pool plays several at once.
+
+    python explore.py [data/01/scene.json ...] [--processes 8] [--json] [--output report.json]
+
+Exits with status 1 if a route hit a dead end or an error.
+"""
+import argparse
+import glob
+import hashlib
+import heapq
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import preload
+import scenes
+import script
+import validate
+
+CHOICE_OPS = (script.Op.CHOICE, script.Op.BCHOICE, script.Op.ITEM)
+
+walker = None  # the worker process's Walker, set up by init_worker
+
+
+def state_key(source, state, stats):
+    """Identifies a choice point: the same key means the same routes lead on from it."""
+    data = [source, state["script"], state["index"], state["op"], stats]
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def flatten_stats(stats):
+    """{stat: total} with the per-character stats spread out as "stat.character"."""
+    flat = {}
+    for stat, value in stats.items():
+        if isinstance(value, dict):
+            for target, points in value.items():
+                flat["{0}.{1}".format(stat, target)] = points
+        else:
+            flat[stat] = value
+    return flat
+
+
+class Walker:
+    """Plays jobs, (source, state, presses), in a worker process.
+
+    A job with no state starts the scene from the beginning. Otherwise the
+    scene is restored to state, a snapshot taken as a choice action ran,
+    and the buttons in presses are pressed in turn once it is shown again.
+    """
+    def __init__(self, max_steps, slowest):
+        self.max_steps = max_steps
+        self.slowest = slowest
+        self.source = None
+        self.next_source = None  # the scene the last end action ran into
+        self.captured = None  # snapshot taken by the last choice action run
+        self.step_times = []  # (ms, location)
+        self.scripts = set()
+
+    def watch(self, scene, source):
+        """Hooks scene's choice and end actions so the walker sees them run, and
+        turns its save actions off: routes must never touch the player's saves."""
+        self.source = source
+        self.scripts.add(scene.prefix + scene.script_file)
+        for op in CHOICE_OPS:
+            scene.handlers[op] = self.capturing(scene, scene.handlers[op])
+        scene.handlers[script.Op.END] = self.ending(scene.handlers[script.Op.END])
+        scene.handlers[script.Op.SAVE] = lambda start: None
+        return scene
+
+    def capturing(self, scene, handler):
+        def capture(*args):
+            self.captured = scene.snapshot(scene.op_index)
+            return handler(*args)
+        return capture
+
+    def ending(self, handler):
+        def end(source):
+            self.next_source = source
+            return handler(source)
+        return end
+
+    def scene_at(self, source, state):
+        scene = scenes.Scene(source)
+        if state is not None:
+            path = scene.prefix + state["script"]
+            scene.script = scene.load_script(path)
+            scene.script_file = state["script"]
+            scene.restore(state)
+        return self.watch(scene, source)
+
+    def timed(self, scene, function, what="", index=None):
+        """Runs function, recording how long it took at step index (by default the one about to run)."""
+        location = "{0} {1}{2} step {3}{4}".format(self.source, scene.prefix, scene.script_file,
+                                                   scene.script_index if index is None else index, what)
+        start = time.perf_counter()
+        result = function()
+        self.step_times.append(((time.perf_counter() - start) * 1000.0, location))
+        self.scripts.add(scene.prefix + scene.script_file)
+        return result
+
+    def run(self, job):
+        try:
+            return self.play(*job)
+        except Exception:
+            return {"kind": "error", "error": traceback.format_exc()}
+
+    def play(self, source, state, presses):
+        preload.prefetcher.discard()  # nothing the last job's scenes were loading is needed
+        self.captured = None
+        self.step_times = []
+        self.scripts = set()
+
+        scene = self.scene_at(source, state)
+        result = self.timed(scene, scene.step)
+        for index in presses:
+            self.captured = None
+            # The choice step has already run, so it is the one before script_index.
+            self.timed(scene, scene.choice_buttons[index].press, ", button {0}".format(index),
+                       scene.script_index - 1)
+            result = False, None
+
+        steps = 0
+        while True:
+            end, next_scene = result
+            if end:
+                if next_scene is None:
+                    return self.report(scene, "ending", "{0}{1}".format(scene.prefix, scene.script_file))
+                scene = self.watch(next_scene, self.next_source)
+                result = self.timed(scene, scene.step)
+                continue
+
+            for character in list(scene.on_screen_characters):
+                character.settle()  # finishes exits, so remove_character runs
+            if scene.choice_point:
+                return self.choice_point(scene, state, presses)
+            if scene.script_index >= len(scene.script):
+                return self.report(scene, "dead end", "{0}{1}: script ends without an ending action".format(
+                    scene.prefix, scene.script_file))
+            steps += 1
+            if steps > self.max_steps:
+                return self.report(scene, "dead end", "{0}{1}: more than {2} steps without a choice".format(
+                    scene.prefix, scene.script_file, self.max_steps))
+            result = self.timed(scene, scene.step)
+
+    def choice_point(self, scene, state, presses):
+        stats = scene.stats.as_dict()
+        if self.captured is not None:
+            state, presses = self.captured, ()  # a new choice was shown
+        # Otherwise a purchase left the same shop open: keep replaying from it.
+        result = self.report(scene, "choice", None)
+        result.update({
+            "key": state_key(self.source, state, stats),
+            "state": state,
+            "presses": presses,
+            "buttons": [(button.active, button.label) for button in scene.choice_buttons],
+        })
+        if not any(button.active for button in scene.choice_buttons):
+            result.update({"kind": "dead end", "where": "{0}{1} step {2}: no button can be pressed".format(
+                scene.prefix, state["script"], state["index"])})
+        return result
+
+    def report(self, scene, kind, where):
+        return {
+            "kind": kind,
+            "where": where,
+            "source": self.source,
+            "stats": scene.stats.as_dict(),
+            "scripts": sorted(self.scripts),
+            "step_times": heapq.nlargest(self.slowest, self.step_times),
+            "steps": len(self.step_times),
+        }
+
+
+def init_worker(max_steps, slowest):
+    global walker
+    pygame.display.init()  # no mixer: the audio player stays silent
+    pygame.font.init()
+    pygame.display.set_mode((1, 1))
+    sys.stdout = open(os.devnull, "w")  # the scene prints every choice
+    walker = Walker(max_steps, slowest)
+
+
+def run_job(job):
+    return walker.run(job)
+
+
+class Coverage:
+    """What the explored routes reached, gathered in the parent process."""
+    def __init__(self, slowest):
+        self.slowest = slowest
+        self.endings = {}  # (source, script) -> {"routes", "example", "stats"}
+        self.dead_ends = {}  # description -> {"routes", "example"}
+        self.errors = []
+        self.scripts = set()
+        self.step_times = {}  # location -> slowest ms seen there
+        self.seen = set()
+        self.jobs = 0
+        self.steps = 0
+        self.duplicates = 0
+        self.truncated = 0
+
+    def add(self, result, route):
+        self.jobs += 1
+        if result["kind"] == "error":
+            self.errors.append({"route": route, "error": result["error"]})
+            return False
+        self.scripts.update(result["scripts"])
+        self.steps += result["steps"]
+        for ms, location in result["step_times"]:
+            self.step_times[location] = max(ms, self.step_times.get(location, 0.0))
+
+        if result["kind"] == "ending":
+            key = "{0} {1}".format(result["source"], result["where"])
+            ending = self.endings.setdefault(key, {"routes": 0, "example": route, "stats": {}})
+            ending["routes"] += 1
+            for stat, value in flatten_stats(result["stats"]).items():
+                low, high = ending["stats"].get(stat, (value, value))
+                ending["stats"][stat] = (min(low, value), max(high, value))
+        elif result["kind"] == "dead end":
+            dead_end = self.dead_ends.setdefault(result["where"], {"routes": 0, "example": route})
+            dead_end["routes"] += 1
+        elif result["key"] in self.seen:
+            self.duplicates += 1
+        else:
+            self.seen.add(result["key"])
+            return True
+        return False
+
+    def as_dict(self, sources, unreachable, wall):
+        return {
+            "scenes": sources,
+            "wall_s": wall,
+            "jobs": self.jobs,
+            "steps": self.steps,
+            "choice_points": len(self.seen),
+            "duplicates": self.duplicates,
+            "truncated": self.truncated,
+            "endings": self.endings,
+            "dead_ends": self.dead_ends,
+            "errors": self.errors,
+            "unreachable_scripts": unreachable,
+            "slowest_steps": [{"ms": ms, "at": location} for location, ms in
+                              heapq.nlargest(self.slowest, self.step_times.items(), key=lambda item: item[1])],
+        }
+
+
+def explore(sources, processes=None, max_depth=200, max_steps=5000, slowest=10):
+    """Plays every route from sources and returns the coverage report as a dict."""
+    start = time.perf_counter()
+    coverage = Coverage(slowest)
+    processes = processes or os.cpu_count() or 1
+    finished = queue.Queue()
+    pending = [(source, None, (), ()) for source in reversed(sources)]  # (source, state, presses, route)
+    running = 0
+
+    pool = multiprocessing.Pool(processes, init_worker, (max_steps, slowest))
+    try:
+        while pending or running:
+            while pending and running < processes * 2:
+                source, state, presses, route = pending.pop()
+                pool.apply_async(run_job, ((source, state, presses),),
+                                 callback=lambda result, route=route: finished.put((result, route)),
+                                 error_callback=lambda error, route=route: finished.put(
+                                     ({"kind": "error", "error": repr(error)}, route)))
+                running += 1
+            result, route = finished.get()
+            running -= 1
+            if not coverage.add(result, route):
+                continue
+            if len(route) >= max_depth:
+                coverage.truncated += 1
+                continue
+            # Pushed last to first, so the first button's routes are played first.
+            for index in reversed(range(len(result["buttons"]))):
+                active, label = result["buttons"][index]
+                if active:
+                    pending.append((result["source"], result["state"], tuple(result["presses"]) + (index,),
+                                    route + (label,)))
+    finally:
+        pool.close()  # not terminate(): SDL turns SIGTERM into a quit event the workers never read
+        pool.join()
+
+    return coverage.as_dict(sources, unreachable_scripts(sources, coverage.scripts), time.perf_counter() - start)
+
+
+def unreachable_scripts(sources, entered):
+    """Scripts in the scenes' directories that no explored route entered."""
+    index = validate.validate(sources)
+    other = set(path for path, kind in index.assets.items() if kind != "script")
+    unreachable = set(path for path in index.scripts if path not in entered)
+    for directory in set(os.path.dirname(source) for source in index.scenes):
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            if path not in other and path not in entered and os.path.basename(path) != "save.json":
+                unreachable.add(path)
+    return sorted(unreachable)
+
+
+def print_report(report):
+    for where, ending in sorted(report["endings"].items()):
+        print("ending {0}: {1} routes, e.g. {2}".format(where, ending["routes"], " > ".join(ending["example"])))
+        for stat, (low, high) in sorted(ending["stats"].items()):
+            print("    {0}: {1}..{2}".format(stat, low, high))
+    for where, dead_end in sorted(report["dead_ends"].items()):
+        print("dead end {0}: {1} routes, e.g. {2}".format(where, dead_end["routes"], " > ".join(dead_end["example"])))
+    for error in report["errors"]:
+        print("error on route {0}:\n{1}".format(" > ".join(error["route"]), error["error"]))
+    for path in report["unreachable_scripts"]:
+        print("unreachable: " + path)
+    for step in report["slowest_steps"]:
+        print("slow: {0:.2f} ms at {1}".format(step["ms"], step["at"]))
+    print("{0} choice points ({1} reached again), {2} jobs, {3} steps, {4} routes cut at --max-depth in {5:.1f} s"
+          .format(report["choice_points"], report["duplicates"], report["jobs"], report["steps"],
+                  report["truncated"], report["wall_s"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play every route through a scene's choices headlessly.")
+    parser.add_argument("scenes", nargs="*", help="scene files to start from (default: data/*/scene.json)")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument("--max-depth", type=int, default=200, help="most buttons pressed along one route")
+    parser.add_argument("--max-steps", type=int, default=5000, help="most steps between two choice points")
+    parser.add_argument("--slowest", type=int, default=10, help="how many of the slowest steps to report")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--output", help="write the JSON report here as well")
+    args = parser.parse_args(argv)
+
+    sources = args.scenes or sorted(glob.glob("data/*/scene.json"))
+    if not sources:
+        parser.error("no scene files found")
+    report = explore(sources, args.processes, args.max_depth, args.max_steps, args.slowest)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(json.dumps(report, indent=2) + "\n")
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if report["dead_ends"] or report["errors"]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
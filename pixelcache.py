@@ -0,0 +1,142 @@
+"""On-disk cache of decoded image pixels.
+
+Decoding PNGs dominates startup, so the first decode of an image also writes
+its raw pixels, in the byte order the display uses, to CACHE_DIR. Later
+launches map that file and wrap it with pygame.image.frombuffer instead of
+inflating the PNG again.
+
+Each entry is named after a hash of the source path. Its header records the
+source's mtime, size and SHA-1. An entry whose mtime or size no longer match
+is re-validated against the hash and rewritten if the content changed. The
+directory is trimmed to MAX_CACHE_SIZE, least recently used first.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+import pygame
+
+CACHE_DIR = os.path.join("cache", "pixels")
+MAX_CACHE_SIZE = 512 * 1024 * 1024  # bytes
+
+MAGIC = b"VNPIX\x00\x00\x02"  # version 2: colorkeyed images are stored translucent
+# magic, pixel format, width, height, translucent, source mtime_ns, source size, source sha1
+HEADER = struct.Struct("<8s4sIIBqq20s")
+
+enabled = True
+
+
+def entry_path(path):
+    return os.path.join(CACHE_DIR, hashlib.sha1(path.encode("utf-8")).hexdigest() + ".px")
+
+
+def pixel_format():
+    """The 32-bit byte order matching the display, so converting a cached image is a plain copy."""
+    display = pygame.display.get_surface()
+    if display is not None and display.get_bitsize() == 32 and sys.byteorder == "little":
+        if display.get_masks()[0] == 0xff0000:
+            return "BGRA"
+    return "RGBA"
+
+
+def file_hash(source_file):
+    digest = hashlib.sha1()
+    for chunk in iter(lambda: source_file.read(1 << 20), b""):
+        digest.update(chunk)
+    return digest.digest()
+
+
+def load(path, stamp, open_source):
+    """Returns (surface, translucent) from the cache, or None on a miss.
+
+    stamp is the source's (mtime_ns, size) and open_source a callable
+    returning a binary file object for it, used only when the stamp changed.
+    The surface shares memory with the mapped cache file and still has to be
+    converted to the display format.
+    """
+    if not enabled:
+        return None
+    cache_path = entry_path(path)
+    try:
+        with open(cache_path, "r+b") as cache_file:
+            data = mmap.mmap(cache_file.fileno(), 0)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        magic, fmt, width, height, translucent, mtime, size, digest = HEADER.unpack_from(data, 0)
+    except struct.error:
+        return None
+    fmt = fmt.decode("ascii")
+    if magic != MAGIC or fmt != pixel_format() or len(data) != HEADER.size + width * height * 4:
+        return None
+
+    if (mtime, size) != tuple(stamp):
+        with open_source() as source_file:
+            if file_hash(source_file) != digest:
+                return None
+        # Touched but unchanged: record the new stamp so the hash is not checked again.
+        data[:HEADER.size] = HEADER.pack(MAGIC, fmt.encode("ascii"), width, height, translucent,
+                                         stamp[0], stamp[1], digest)
+
+    try:
+        os.utime(cache_path)  # mtime doubles as the last-used time for trimming
+    except OSError:
+        pass
+    pixels = memoryview(data)[HEADER.size:]
+    return pygame.image.frombuffer(pixels, (width, height), fmt), bool(translucent)
+
+
+def store(path, surface, translucent, stamp, open_source):
+    """Writes surface's pixels to the cache; failures just leave the image uncached."""
+    if not enabled:
+        return
+    fmt = pixel_format()
+    try:
+        with open_source() as source_file:
+            digest = file_hash(source_file)
+        pixels = pygame.image.tostring(surface, fmt)
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        cache_path = entry_path(path)
+        temp_path = "{0}.{1}.tmp".format(cache_path, os.getpid())
+        with open(temp_path, "wb") as cache_file:
+            cache_file.write(HEADER.pack(MAGIC, fmt.encode("ascii"), surface.get_width(), surface.get_height(),
+                                         translucent, stamp[0], stamp[1], digest))
+            cache_file.write(pixels)
+        os.replace(temp_path, cache_path)
+    except (OSError, ValueError, pygame.error):
+        return
+    trim()
+
+
+def trim(max_size=None):
+    """Deletes least recently used entries until the cache fits in max_size bytes."""
+    max_size = MAX_CACHE_SIZE if max_size is None else max_size
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError:
+        return
+    entries = []
+    total = 0
+    for name in names:
+        if not name.endswith(".px"):
+            continue
+        entry = os.path.join(CACHE_DIR, name)
+        try:
+            stat = os.stat(entry)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+        total += stat.st_size
+    entries.sort()
+    for mtime, size, entry in entries:
+        if total <= max_size:
+            break
+        try:
+            os.remove(entry)
+        except OSError:
+            continue
+        total -= size
@@ -0,0 +1,50 @@
+import collections
+import concurrent.futures
+
+MAX_PENDING = 32  # prefetched results kept around waiting to be claimed
+
+
+class Prefetcher:
+    """Runs loaders on a background thread ahead of the moment they are needed.
+
+    prefetch() schedules loader(*args) under a key; get() hands over the
+    finished result (waiting for it if the worker is still busy) or runs the
+    loader synchronously if nothing was scheduled for that key.
+    """
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self.pending = collections.OrderedDict()  # key -> Future
+
+    def prefetch(self, key, loader, *args):
+        if key in self.pending:
+            return
+        self.pending[key] = self.executor.submit(loader, *args)
+        while len(self.pending) > MAX_PENDING:
+            key, future = self.pending.popitem(last=False)
+            future.cancel()
+
+    def run(self, loader, *args):
+        """Fire-and-forget variant of prefetch for loaders that fill a cache themselves.
+
+        Returns the Future, for callers that keep track of the result on their own.
+        """
+        return self.executor.submit(loader, *args)
+
+    def get(self, key, loader, *args):
+        future = self.pending.pop(key, None)
+        if future is None or future.cancelled():
+            return loader(*args)
+        return future.result()
+
+    def discard(self, owner=None):
+        """Drops every prefetch that has not been claimed yet, or only those whose key ends in owner."""
+        for key in list(self.pending):
+            if owner is None or key[-1] is owner:
+                self.pending.pop(key).cancel()
+
+    def shutdown(self):
+        self.discard()
+        self.executor.shutdown(wait=False)
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,150 @@
+"""Per-frame timing and counters for the game loop.
+
+Phases are timed with `with profiler.phase("name"):`, counters bumped with
+profiler.count() and one-off events (asset loads) recorded with
+profiler.record(). Everything goes into a rolling buffer that write_trace()
+saves in the Chrome trace-event format (load it in chrome://tracing or
+Perfetto), and the last frame's numbers can be drawn as an overlay.
+
+All of it is a no-op until profiler.enabled is set.
+"""
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+import pygame
+
+TRACE_EVENTS = 50000  # events kept in the rolling trace buffer
+TRACE_PATH = "trace.json"
+FRAME_HISTORY = 120  # frames averaged for the overlay
+
+overlay_color = (255, 255, 0)
+overlay_background = (0, 0, 0, 170)
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.show_overlay = False
+
+        self.events = collections.deque(maxlen=TRACE_EVENTS)
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+
+        self.phases = collections.OrderedDict()  # phase -> seconds, current frame
+        self.counters = collections.Counter()  # current frame
+        self.last_phases = {}
+        self.last_counters = {}
+        self.frame_times = collections.deque(maxlen=FRAME_HISTORY)
+        self.frame_start = None
+
+        self.asset_loads = 0
+        self.font = None
+
+    def timestamp(self, seconds):
+        return (seconds - self.origin) * 1000000.0  # trace events use microseconds
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.phases[name] = self.phases.get(name, 0.0) + end - start
+            self.record(name, start, end, "phase")
+
+    def record(self, name, start, end, category, args=None):
+        """Adds a complete event that ran from start to end (perf_counter seconds)."""
+        if not self.enabled:
+            return
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": self.timestamp(start),
+            "dur": (end - start) * 1000000.0,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        self.events.append(event)
+        if category == "asset":
+            self.asset_loads += 1
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def begin_frame(self):
+        if self.enabled:
+            self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        if not self.enabled or self.frame_start is None:
+            return
+        end = time.perf_counter()
+        self.frame_times.append(end - self.frame_start)
+        self.record("frame", self.frame_start, end, "frame")
+        self.events.append({
+            "name": "per frame",
+            "ph": "C",
+            "ts": self.timestamp(end),
+            "pid": self.pid,
+            "args": dict(self.counters),
+        })
+        self.last_phases = self.phases
+        self.last_counters = self.counters
+        self.phases = collections.OrderedDict()
+        self.counters = collections.Counter()
+        self.frame_start = None
+
+    def toggle_overlay(self):
+        self.show_overlay = not self.show_overlay
+        if self.show_overlay:
+            self.enabled = True
+
+    def overlay_lines(self):
+        lines = []
+        if self.frame_times:
+            average = sum(self.frame_times) / len(self.frame_times)
+            lines.append("frame {0:.2f} ms avg, {1:.2f} ms max".format(average * 1000.0, max(self.frame_times) * 1000.0))
+        for name, seconds in self.last_phases.items():
+            lines.append("{0:<10} {1:.2f} ms".format(name, seconds * 1000.0))
+        for name, amount in sorted(self.last_counters.items()):
+            lines.append("{0:<10} {1}".format(name, amount))
+        lines.append("asset loads {0}".format(self.asset_loads))
+        return lines
+
+    def get_overlay(self, extra_lines=()):
+        """Returns a surface with the last frame's numbers."""
+        if self.font is None:
+            self.font = pygame.font.Font(None, 20)
+        lines = self.overlay_lines() + list(extra_lines)
+        line_height = self.font.get_linesize()
+        width = max(self.font.size(line)[0] for line in lines) + 8
+        surface = pygame.Surface((width, line_height * len(lines) + 8), pygame.SRCALPHA)
+        surface.fill(overlay_background)
+        for index, line in enumerate(lines):
+            surface.blit(self.font.render(line, True, overlay_color), (4, 4 + index * line_height))
+        return surface
+
+    def write_trace(self, path=TRACE_PATH):
+        """Saves the rolling buffer as a Chrome trace-event JSON file."""
+        events = list(self.events)
+        events.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": threading.main_thread().ident,
+                       "args": {"name": "main"}})
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+        os.replace(temp_path, path)
+
+
+profiler = Profiler()
@@ -0,0 +1,75 @@
+"""Which script steps the player has already seen, for skip-read fast-forward.
+
+Every script gets a bitset with one bit per step. It is read from READ_DIR
+the first time the script is played and written back by flush(), only if
+it changed. The stored bitset is only used if the script still has the same
+number of steps. Otherwise the script was edited, and its steps start unread again.
+"""
+import os
+import struct
+
+import saves
+
+READ_DIR = "data/01/read"
+MAGIC = b"VNRD"
+HEADER = struct.Struct("<4sI")  # magic, step count
+
+
+class Bitset:
+    def __init__(self, size, data=None):
+        self.size = size
+        self.bits = bytearray(data) if data is not None else bytearray((size + 7) // 8)
+        self.dirty = False
+
+    def __contains__(self, index):
+        return 0 <= index < self.size and bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def add(self, index):
+        if 0 <= index < self.size and index not in self:
+            self.bits[index >> 3] |= 1 << (index & 7)
+            self.dirty = True
+
+
+class ReadLog:
+    def __init__(self, directory=READ_DIR):
+        self.directory = directory
+        self.scripts = {}  # script path -> Bitset, loaded on first use
+
+    def file_path(self, path):
+        return os.path.join(self.directory, path.replace("/", "_").replace("\\", "_") + ".read")
+
+    def bitset(self, path, steps):
+        bitset = self.scripts.get(path)
+        if bitset is None or bitset.size != steps:
+            bitset = self.scripts[path] = self.load(path, steps)
+        return bitset
+
+    def load(self, path, steps):
+        try:
+            with open(self.file_path(path), "rb") as read_file:
+                data = read_file.read()
+        except OSError:
+            return Bitset(steps)
+        if len(data) != HEADER.size + (steps + 7) // 8 or HEADER.unpack_from(data) != (MAGIC, steps):
+            return Bitset(steps)  # another script, or an older version of this one
+        return Bitset(steps, data[HEADER.size:])
+
+    def is_read(self, path, steps, index):
+        return index in self.bitset(path, steps)
+
+    def mark(self, path, steps, index):
+        self.bitset(path, steps).add(index)
+
+    def flush(self):
+        """Writes every bitset that changed since it was loaded."""
+        for path, bitset in self.scripts.items():
+            if bitset.dirty:
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    saves.write_atomic(self.file_path(path), HEADER.pack(MAGIC, bitset.size) + bytes(bitset.bits))
+                except OSError:
+                    continue  # stays dirty; losing read marks only means less can be skipped
+                bitset.dirty = False
+
+
+log = ReadLog()
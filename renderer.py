@@ -0,0 +1,221 @@
+import weakref
+
+import pygame
+
+import assets
+import profiler
+
+FULL_REDRAW_RATIO = 0.6  # above this fraction of the screen, redraw everything in one pass
+
+output_rect = None  # where logical frames are presented in the window; None means 1:1 at the origin
+
+
+def fit(logical_size, window_size):
+    """The largest rect with logical_size's aspect ratio, centred in a window of window_size."""
+    scale = min(window_size[0] / logical_size[0], window_size[1] / logical_size[1])
+    rect = pygame.Rect(0, 0, max(1, round(logical_size[0] * scale)), max(1, round(logical_size[1] * scale)))
+    rect.center = (window_size[0] // 2, window_size[1] // 2)
+    return rect
+
+
+def set_output(logical_size, window_size):
+    """Makes every ScaledRenderer present logical_size frames letterboxed into window_size."""
+    global output_rect
+    output_rect = fit(logical_size, window_size)
+    return output_rect
+
+
+def to_window(rect, logical_size):
+    """Maps a logical rect to the window rect it is presented in."""
+    if output_rect is None:
+        return pygame.Rect(rect)
+    scale_x = output_rect.w / logical_size[0]
+    scale_y = output_rect.h / logical_size[1]
+    left, top = round(rect.left * scale_x), round(rect.top * scale_y)
+    return pygame.Rect(output_rect.x + left, output_rect.y + top,
+                       round(rect.right * scale_x) - left, round(rect.bottom * scale_y) - top)
+
+
+def to_logical(pos, logical_size):
+    """Maps a window position (such as the mouse's) to logical coordinates."""
+    if output_rect is None:
+        return pos
+    return (int((pos[0] - output_rect.x) * logical_size[0] / output_rect.w),
+            int((pos[1] - output_rect.y) * logical_size[1] / output_rect.h))
+
+
+class DirtyRenderer:
+    """Retained-mode compositor that only redraws the regions that changed.
+
+    Every frame the owner calls begin(), add()s its layers back to front and
+    then render(). A layer is identified by a key object; it is considered
+    changed when its surface, its rect or its version differ from the previous
+    frame, in which case both the old and the new area are redrawn.
+
+    A layer whose pixels changed only in part can pass changed=(old_version,
+    area): if the previous frame showed old_version of the same surface at
+    the same place, only area (in surface coordinates) is redrawn.
+    """
+    def __init__(self, size):
+        self.surface = pygame.Surface(size)
+        if pygame.display.get_surface():
+            self.surface = self.surface.convert()
+        self.rect = self.surface.get_rect()
+
+        self.layers = {}  # key -> (surface, rect, version) as of the last frame
+        self.order = []
+        self.seen = set()
+
+        self.dirty = []
+        self.mark_all()
+
+        # Blits in the last render() and how many needed no pixel format conversion.
+        self.blits = 0
+        self.fast_blits = 0
+
+    def mark(self, rect):
+        rect = self.rect.clip(rect)
+        if rect.w and rect.h:
+            self.dirty.append(rect)
+
+    def mark_all(self):
+        self.dirty = [self.rect.copy()]
+
+    def begin(self):
+        self.order = []
+        self.seen = set()
+
+    def add(self, key, surface, rect, version=0, changed=None):
+        rect = pygame.Rect(rect.topleft, surface.get_size())
+        state = (surface, tuple(rect), version)
+        old = self.layers.get(key)
+        if old is None:
+            self.mark(rect)
+        elif old[2] != version and old[0] is surface and old[1] == state[1] \
+                and changed is not None and changed[0] == old[2]:
+            self.mark(pygame.Rect(changed[1]).move(rect.topleft))
+        elif old[0] is not surface or old[1] != state[1] or old[2] != version:
+            self.mark(pygame.Rect(old[1]))
+            self.mark(rect)
+        self.layers[key] = state
+        self.order.append((surface, rect))
+        self.seen.add(key)
+
+    def render(self):
+        """Redraws the dirty regions and returns them as a list of rects."""
+        for key in [key for key in self.layers if key not in self.seen]:
+            self.mark(pygame.Rect(self.layers.pop(key)[1]))
+
+        rects = self._merge()
+        self.blits = 0
+        self.fast_blits = 0
+        for rect in rects:
+            self.surface.set_clip(rect)
+            for surface, layer_rect in self.order:
+                if layer_rect.colliderect(rect):
+                    self.surface.blit(surface, layer_rect)
+                    self.blits += 1
+                    if assets.is_display_format(surface):
+                        self.fast_blits += 1
+        self.surface.set_clip(None)
+
+        self.dirty = []
+        return rects
+
+    def report(self):
+        return "{0} of {1} blits on the fast path (display pixel format)".format(self.fast_blits, self.blits)
+
+    def _merge(self):
+        if not self.dirty:
+            return []
+
+        merged = []
+        for rect in self.dirty:
+            index = rect.collidelist(merged)
+            while index != -1:
+                rect = rect.union(merged.pop(index))
+                index = rect.collidelist(merged)
+            merged.append(rect)
+
+        area = sum(rect.w * rect.h for rect in merged)
+        if area > self.rect.w * self.rect.h * FULL_REDRAW_RATIO:
+            return [self.rect.copy()]
+        return merged
+
+
+class ScaledRenderer(DirtyRenderer):
+    """DirtyRenderer that takes layers in logical coordinates and composes them at output_rect's size.
+
+    Layer surfaces are smoothscaled once per surface, version and output size.
+    The copies are held weakly by their source surface, so an image evicted
+    from the asset cache takes its scaled copy with it. After a resize, only
+    the layers that are drawn again get rescaled.
+    """
+    def __init__(self, logical_size):
+        self.logical_size = tuple(logical_size)
+        self.output = pygame.Rect((0, 0), self.logical_size)
+        self.scaled = weakref.WeakKeyDictionary()  # source surface -> (version, output size, scaled copy)
+        super(ScaledRenderer, self).__init__(self.logical_size)
+
+    def begin(self):
+        output = output_rect or pygame.Rect((0, 0), self.logical_size)
+        if output != self.output:
+            self.resize(output)
+        super(ScaledRenderer, self).begin()
+
+    def resize(self, output):
+        self.output = output.copy()
+        self.surface = pygame.Surface(output.size)
+        if pygame.display.get_surface():
+            self.surface = self.surface.convert()
+        self.rect = self.surface.get_rect()
+        self.layers = {}  # their rects are in the old output size
+        self.mark_all()
+
+    def is_scaled(self):
+        return self.output.size != self.logical_size
+
+    def add(self, key, surface, rect, version=0, changed=None):
+        if self.is_scaled():
+            surface, changed = self.scale(surface, version, changed)
+            rect = pygame.Rect(self.to_output(rect.topleft), surface.get_size())
+        super(ScaledRenderer, self).add(key, surface, rect, version, changed)
+
+    def to_output(self, pos):
+        return (round(pos[0] * self.output.w / self.logical_size[0]),
+                round(pos[1] * self.output.h / self.logical_size[1]))
+
+    def scale_rect(self, rect):
+        left, top = self.to_output(rect.topleft)
+        right, bottom = self.to_output(rect.bottomright)
+        return pygame.Rect(left, top, right - left, bottom - top)
+
+    def scale(self, surface, version, changed=None):
+        """Returns the scaled copy of surface and changed mapped onto it."""
+        size = self.output.size
+        entry = self.scaled.get(surface)
+        if entry is not None and entry[1] == size:
+            if entry[0] == version:
+                return entry[2], None
+            if changed is not None and changed[0] == entry[0]:
+                # Only rescale the part that changed, straight into the existing copy.
+                scaled = entry[2]
+                area = pygame.Rect(changed[1]).clip(surface.get_rect())
+                target = self.scale_rect(area).clip(scaled.get_rect())
+                if target.w and target.h:
+                    pygame.transform.smoothscale(surface.subsurface(area), target.size, scaled.subsurface(target))
+                    profiler.profiler.count("partial scales")
+                self.scaled[surface] = (version, size, scaled)
+                return scaled, (changed[0], target)
+        width, height = surface.get_size()
+        if not width or not height:
+            return surface, None
+        scaled_size = self.to_output((width, height))
+        scaled_size = (max(1, scaled_size[0]), max(1, scaled_size[1]))
+        try:
+            scaled = pygame.transform.smoothscale(surface, scaled_size)
+        except ValueError:  # smoothscale only takes 24 and 32 bit surfaces
+            scaled = pygame.transform.scale(surface, scaled_size)
+        profiler.profiler.count("scales")
+        self.scaled[surface] = (version, size, scaled)
+        return scaled, None
@@ -0,0 +1,42 @@
+"""Bounded history of scene state deltas, for stepping back through dialogue.
+
+Around every step, choice and purchase, the scene hands begin() and end()
+the same small dict of state: references and scalars such as the script,
+step index, ledger mark, background name and on-screen characters. end()
+keeps only the entries that changed, with their old values. Nothing is
+copied: compiled scripts and buttons are never modified, and stats are
+undone through the ledger's change log. Undoing a step therefore costs
+O(what the step changed).
+
+Deltas go into a deque of at most max_steps entries; older ones fall off.
+"""
+import collections
+
+max_steps = 200  # deltas kept per scene; main() sets it from VN_ROLLBACK
+
+
+class History:
+    def __init__(self, limit=None):
+        self.deltas = collections.deque(maxlen=max_steps if limit is None else limit)
+        self.before = None  # state given to begin(), while a change is being recorded
+
+    @property
+    def recording(self):
+        return self.before is not None
+
+    def begin(self, state):
+        self.before = state
+
+    def end(self, state):
+        before, self.before = self.before, None
+        delta = dict((key, value) for key, value in before.items()
+                     if value is not state[key] and value != state[key])
+        if delta:
+            self.deltas.append(delta)
+
+    def pop(self):
+        """The delta undoing the last change, or None if there is none left."""
+        return self.deltas.pop() if self.deltas else None
+
+    def clear(self):
+        self.deltas.clear()
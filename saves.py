@@ -0,0 +1,118 @@
+"""Numbered save slots written off the main thread.
+
+save() serializes on the caller's thread and hands the bytes to a writer
+thread. Saves to the same slot that arrive before the writer gets to them
+are coalesced, so only the newest is written. Every file goes to a
+temporary file, is fsynced and then renamed over the old one, so a crash
+never leaves a half-written save behind. index.json lists the slots so
+menus never have to open the saves themselves.
+"""
+import json
+import os
+import threading
+import time
+
+SAVE_DIR = "data/01/saves"
+INDEX_FILE = "index.json"
+COALESCE_DELAY = 0.2  # seconds the writer waits for more saves before writing
+
+
+def write_atomic(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as temp_file:
+        temp_file.write(data)
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+    os.replace(temp_path, path)
+    if hasattr(os, "O_DIRECTORY"):  # make the rename itself durable
+        directory = os.open(os.path.dirname(path) or ".", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+class SaveManager:
+    def __init__(self, directory=SAVE_DIR):
+        self.directory = directory
+        self.index = None  # slot (str) -> {"label", "time", "file"}, loaded on first use
+
+        self.pending = {}  # slot -> (payload bytes, index entry)
+        self.writing = False
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def slot_path(self, slot):
+        return os.path.join(self.directory, "slot{0}.json".format(slot))
+
+    def load_index(self):
+        if self.index is None:
+            try:
+                with open(os.path.join(self.directory, INDEX_FILE), "rb") as index_file:
+                    self.index = json.load(index_file)
+            except (OSError, ValueError):
+                self.index = {}
+        return self.index
+
+    def slots(self):
+        """Returns [(slot, entry)] for every saved or pending slot, in slot order."""
+        with self.condition:
+            entries = dict(self.load_index())
+            for slot, (payload, entry) in self.pending.items():
+                entries[str(slot)] = entry
+        return sorted(((int(slot), entry) for slot, entry in entries.items()), key=lambda item: item[0])
+
+    def next_slot(self):
+        used = [slot for slot, entry in self.slots()]
+        return max(used) + 1 if used else 1
+
+    def save(self, slot, data, label=""):
+        """Queues data (any JSON-serializable object) to be written to slot."""
+        payload = json.dumps(data).encode("utf-8")
+        entry = {"label": label, "time": time.time(), "file": os.path.basename(self.slot_path(slot))}
+        with self.condition:
+            self.pending[slot] = (payload, entry)
+            self.condition.notify()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="save-writer", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+            time.sleep(COALESCE_DELAY)
+            with self.condition:
+                pending = self.pending
+                self.pending = {}
+                self.writing = True
+                index = dict(self.load_index())
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                for slot, (payload, entry) in pending.items():
+                    write_atomic(self.slot_path(slot), payload)
+                    index[str(slot)] = entry
+                write_atomic(os.path.join(self.directory, INDEX_FILE),
+                             json.dumps(index, indent=1, sort_keys=True).encode("utf-8"))
+            except OSError as error:
+                print("Could not write save: {0}".format(error))
+            finally:
+                with self.condition:
+                    self.index = index
+                    self.writing = False
+                    self.condition.notify_all()
+
+    def flush(self, timeout=5.0):
+        """Blocks until every queued save is on disk (or timeout seconds pass)."""
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.pending or self.writing:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+manager = SaveManager()
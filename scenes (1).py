@@ -1,149 +1,339 @@
 import pygame
 import json
+import assets
+import audio
 import buttons
 import inputbox
-import main
+import preload
+import profiler
+import readstate
+import renderer
+import rollback
+import saves
+import script
+import stats
+import textlayout
+import tween
 from pygame.locals import *
 
 white = (255, 255, 255)
 blue = (0, 0, 255)
 black = (0, 0, 0)
 
+LOOKAHEAD = 3  # script steps whose images are decoded ahead of time
+
+MOVE_TIME = 700  # ms a character takes to walk to its place
+
+SNAPSHOT_VERSION = 2  # bumped whenever the layout of Scene.snapshot() changes
+
+# Version 1 snapshots stored stats under the Scene attributes they used to live in.
+SNAPSHOT_V1_STATS = {
+    "money": "money",
+    "infamy_points": "infamy",
+    "ability_points": "ability",
+    "class_reputation": "reputation",
+    "kaiser_trust": "trust",
+}
+
+# "update" action -> text showing the total; {0} is the total, {1} the character for affinity
+UPDATE_TEXT = {
+    "money": "Total Money:     {0}  Yen",
+    "infamy": "Total Infamy:     {0}",
+    "reputation": "Total Class Reputation:   {0}",
+    "ability": "Total Ability Points:    {0}",
+    "trust": "Total Kaiser's Trust:   {0}",
+    "affinity": "Total Affinity for {1} is {0}",
+}
+
+# Shop effect -> how it is described after a purchase
+EFFECT_TEXT = {
+    "money": "{0} yen",
+    "infamy": "{0} infamy points",
+    "ability": "{0} ability points",
+    "reputation": "{0} class reputation",
+    "trust": "{0} Kaiser's trust",
+    "affinity": "{0} {1} affinity points",
+}
+
+# Text box style -> (text font and name font paths, their sizes)
+TEXT_STYLES = {
+    "dialogue": (("data/fonts/Amiko-Regular.ttf", "data/fonts/Amiko-Bold.ttf"), (18, 18)),
+    "thought": (("data/fonts/Arimo-Italic-Latin.ttf", "data/fonts/Amiko-Bold.ttf"), (18, 18)),
+    "action": (("data/fonts/Bam.TTF", "data/fonts/Amiko-Bold.ttf"), (18, 18)),
+    "effect": (("data/fonts/Amiko-SemiBold.ttf", "data/fonts/Amiko-Bold.ttf"), (25, 25)),
+}
+
 
 class TextBox:
     def __init__(self, pos, image_path, font_paths, text_rects, font_sizes=(18, 18), text_color=blue):
-        self.image = pygame.image.load(image_path).convert_alpha()
+        self.image = assets.load_image(image_path)
         self.rect = self.image.get_rect()
         self.rect.topleft = pos
 
         self.text = ''
         self.text_scrolling = False
 
-        self.text_font = pygame.font.Font(font_paths[0], font_sizes[0])
-        self.character_name_font = pygame.font.Font(font_paths[1], font_sizes[1])
+        self.text_font = assets.load_font(font_paths[0], font_sizes[0])
+        self.character_name_font = assets.load_font(font_paths[1], font_sizes[1])
+        self.text_layout = textlayout.get_layout(font_paths[0], font_sizes[0])
 
         self.text_color = text_color
         self.character_text_color = text_color
 
-        self.text_surface = self.text_font.render("", True, self.text_color)
-        self.character_name_surface = self.character_name_font.render("", True, self.character_text_color)
+        self.name_surfaces = {}  # (name, color) -> rendered name, kept for later lines
+        self.character_name_surface = self.render_name("", self.character_text_color)
 
         self.text_space = text_rects[0]
         self.character_name_rect = text_rects[1]
 
+        # Text is laid out once per set_text; scrolling copies newly revealed
+        # slices of the pre-rendered lines onto a persistent surface.
+        self.text_surface = pygame.Surface(self.text_space.size, pygame.SRCALPHA)
+        self.lines = []
+        self.line_surfaces = []
+        self.line_offsets = []  # per line: x offset of every character boundary
+        self.line_starts = []  # per line: index of its first character in self.text
+        self.line_height = self.text_font.get_linesize()
+        self.revealed = 0
+        self.revealed_line = 0
+
         self.time_passed = 0
-        self.text_index = 1
+        self.text_index = 0
+
+        profiler.profiler.count("surfaces")
+        self.version = 0  # bumped whenever text_surface changes
+        self.last_change = None  # (previous version, area of text_surface) if the last change was partial
 
     def update(self, dt):
         if self.text_scrolling:
             self.time_passed += dt
             self.text_index = int(self.time_passed / 30)
-            try:
-                if self.text[self.text_index] == '\n':
-                    self.text_index += 1
-            except IndexError:
+            if self.text_index >= len(self.text):
                 self.text_scrolling = False
                 self.text_index = len(self.text)
                 self.time_passed = 0
-            self.text_surface = self.text_font.render(self.text[:self.text_index], True, self.text_color)
-
-    def get_surface(self):
-        return_surface = self.image.copy()
-        return_surface.blit(self.character_name_surface, self.character_name_rect)
-        return_surface.blit(self.text_surface, self.text_space)
-        return return_surface, self.rect
+            self.reveal(self.text_index)
+
+    def get_layers(self):
+        """Returns (part, surface, rect, version, changed) for the frame, the name and the text, back to front.
+
+        The frame and name surfaces are shared and rarely change, so a scaled
+        renderer can keep scaled copies of them; changed says which part of the
+        text surface the last reveal touched.
+        """
+        topleft = self.rect.topleft
+        return (
+            ("frame", self.image, self.rect, 0, None),
+            ("name", self.character_name_surface, self.character_name_rect.move(topleft), 0, None),
+            ("text", self.text_surface, self.text_space.move(topleft), self.version, self.last_change),
+        )
 
     def set_text(self, text):
-        words = text.split()
-        max_width = self.text_space.w
-        rt_text = ''
-
-        for word in words:
-            test_add = rt_text + ' ' + word
-            if self.text_font.size(test_add)[0] > max_width:
-                rt_text = rt_text + '\n'
-            else:
-                rt_text = test_add
-
-        self.text = rt_text[1:]
-        self.text_surface = self.text_font.render(rt_text[0], True, self.text_color)
+        lines = self.text_layout.wrap(text, self.text_space.w)
+        self.text = '\n'.join(lines)
+        self.layout(lines)
         self.text_scrolling = True
 
+    def layout(self, lines):
+        self.lines = lines
+        del self.line_surfaces[:]
+        del self.line_offsets[:]
+        del self.line_starts[:]
+
+        profiler.profiler.count("renders", len(lines))
+        start = 0
+        for line in lines:
+            self.line_surfaces.append(self.text_font.render(line, True, self.text_color))
+            offsets = [0]
+            for metrics in self.text_font.metrics(line):
+                offsets.append(offsets[-1] + (metrics[4] if metrics else 0))
+            self.line_offsets.append(offsets)
+            self.line_starts.append(start)
+            start += len(line) + 1  # the '\n' between lines
+
+        self.text_surface.fill((0, 0, 0, 0))
+        self.revealed = 0
+        self.revealed_line = 0
+        self.time_passed = 0
+        self.text_index = 0
+        self.version += 1
+        self.last_change = None
+
+    def reveal(self, index):
+        """Copies the characters between the last revealed index and index onto the text surface."""
+        index = min(index, len(self.text))
+        changed = None
+        while self.revealed < index and self.revealed_line < len(self.lines):
+            line_no = self.revealed_line
+            line_surface = self.line_surfaces[line_no]
+            offsets = self.line_offsets[line_no]
+            start = self.line_starts[line_no]
+            end = start + len(self.lines[line_no])
+
+            stop = min(index, end)
+            x0 = offsets[self.revealed - start]
+            x1 = line_surface.get_width() if stop == end else offsets[stop - start]
+            if x1 > x0:
+                area = pygame.Rect(x0, 0, x1 - x0, line_surface.get_height())
+                # RGBA_MAX copies pixels onto the cleared surface without re-blending their alpha.
+                blitted = self.text_surface.blit(line_surface, (x0, line_no * self.line_height), area,
+                                                 pygame.BLEND_RGBA_MAX)
+                changed = blitted if changed is None else changed.union(blitted)
+
+            self.revealed = stop
+            if stop == end:
+                self.revealed_line += 1
+                self.revealed = min(end + 1, len(self.text))
+        if changed:
+            self.last_change = (self.version, changed)
+            self.version += 1
+
+    def render_name(self, name, color):
+        key = (name, tuple(color))
+        surface = self.name_surfaces.get(key)
+        if surface is None:
+            profiler.profiler.count("renders")
+            surface = self.name_surfaces[key] = self.character_name_font.render(name, True, color)
+        return surface
+
     def set_character(self, name, color):
-        self.character_name_surface = self.character_name_font.render(name, True, color)
+        self.character_name_surface = self.render_name(name, color)
+
+    def clear(self):
+        """Empties the box so it can be reused for another line."""
+        self.text = ''
+        self.text_scrolling = False
+        self.character_name_surface = self.render_name("", self.character_text_color)
+        self.layout([])
 
     def skip_scroll(self):
         self.text_scrolling = False
         self.time_passed = 0
-        self.text_surface = self.text_font.render(self.text, True, self.text_color)
+        self.text_index = len(self.text)
+        self.reveal(self.text_index)
+
+
+class TextBoxPool:
+    """One TextBox per TEXT_STYLES entry, built on first use and reused for every later line.
+
+    get() hands back the style's box emptied, so switching style or text
+    costs no file reads or new surfaces once every style has been seen.
+    """
+    def __init__(self):
+        self.boxes = {}
+
+    def get(self, style):
+        box = self.boxes.get(style)
+        if box is None:
+            font_paths, font_sizes = TEXT_STYLES[style]
+            box = self.boxes[style] = TextBox(
+                (0, 650),
+                "data/images/textbox.png",
+                font_paths,
+                (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21))),
+                font_sizes
+            )
+        else:
+            box.clear()
+        return box
+
+
+text_boxes = TextBoxPool()
 
 
 class Character:
-    def __init__(self, name, sprite_path_dict, text_color):
+    def __init__(self, name, sprite_path_dict, text_color, tweens):
         self.name = name
 
         self.sprites = {}
         for name, path in sprite_path_dict.items():
-            self.sprites[name] = pygame.image.load(path).convert_alpha()
+            self.sprites[name] = assets.LazyImage(path)
 
         self.sprite = pygame.Surface((0, 0))
+        self.sprite_key = None
 
         self.text_color = text_color
 
         self.rect = self.sprite.get_rect()
         self.rect.bottomleft = (1280, 720)
-        self.x, self.y = self.rect.topleft
 
-        self.target_rect = self.rect
-        self.speed = 0
+        # Animated properties; while one is moving, its current value lives in self.tweens.
+        self.tweens = tweens
+        self.slots = {}  # property -> tween slot
+        self.x, self.y = self.rect.topleft
+        self.alpha = 255
+        self.scale = 1.0
+        self.transformed = (None, None, None, None)  # (sprite, alpha, scale, surface) last drawn
 
         self.exiting = False
 
     def get_surface(self):
-        return self.sprite, self.rect
-
-    def update(self, dt):
-        if self.target_rect != self.rect:
-            x_dist = abs(self.rect.x - self.target_rect.x) + 7
-            y_dist = abs(self.rect.y - self.target_rect.y) + 7
-
-            x_change = min((x_dist / 2.5) * (dt / 500) * self.speed, 200 * (dt / 1000) * self.speed)
-            y_change = min((y_dist / 2.5) * (dt / 500) * self.speed, 200 * (dt / 1000) * self.speed)
-
-            x, y = self.x, self.y
-            target_x, target_y = self.target_rect.topleft
-            if target_x - x < 0:
-                x_change = -x_change
-            if target_y - y < 0:
-                y_change = -y_change
-
-            if abs(target_x - x) < (x_change + 2):
-                x = target_x
-            else:
-                x += x_change
-            if abs(target_y - y) < (y_change + 2):
-                y = target_y
-            else:
-                y += y_change
-            self.x, self.y = x, y
-        else:
-            self.speed = 0
+        for prop, slot in self.slots.items():
+            setattr(self, prop, self.tweens.value(slot))
         self.rect.topleft = (self.x, self.y)
+        if self.alpha == 255 and self.scale == 1.0:
+            return self.sprite, self.rect
+        return self.transform(), self.rect
+
+    def transform(self):
+        """The sprite with alpha and scale applied, redone only when one of them changed."""
+        sprite, alpha, scale, surface = self.transformed
+        if sprite is not self.sprite or alpha != self.alpha or scale != self.scale:
+            surface = self.sprite
+            if self.scale != 1.0:
+                size = (max(1, int(surface.get_width() * self.scale)), max(1, int(surface.get_height() * self.scale)))
+                surface = pygame.transform.smoothscale(surface, size)
+            else:
+                surface = surface.copy()
+            if self.alpha != 255:
+                if surface.get_flags() & pygame.SRCALPHA:
+                    surface.fill((255, 255, 255, int(self.alpha)), special_flags=pygame.BLEND_RGBA_MULT)
+                else:
+                    surface.set_alpha(int(self.alpha))
+            self.transformed = (self.sprite, self.alpha, self.scale, surface)
+        return surface
+
+    def is_moving(self):
+        return bool(self.slots)
 
     def set_sprite(self, sprite_key):
-        self.sprite = self.sprites[sprite_key]
-        self.rect = self.sprites[sprite_key].get_rect()
+        self.sprite_key = sprite_key
+        self.sprite = self.sprites[sprite_key].get()
+        self.rect = self.sprite.get_rect()
         self.rect.topleft = (self.x, self.y)
 
-    def exit(self):
-        target = self.rect.copy()
-        target.right = -100
-        self.move(target)
+    def animate(self, prop, end, duration=MOVE_TIME, on_done=None):
+        """Tweens prop ("x", "y", "alpha" or "scale") to end; on_done is called once it gets there."""
+        slot = self.slots.pop(prop, None)
+        if slot is not None:
+            self.tweens.cancel(slot)
+            setattr(self, prop, self.tweens.value(slot))
+
+        def done():
+            del self.slots[prop]
+            setattr(self, prop, end)
+            if on_done is not None:
+                on_done()
+        self.slots[prop] = self.tweens.start(getattr(self, prop), end, duration, done)
+
+    def exit(self, on_done=None):
+        self.animate("x", -100 - self.rect.w, on_done=on_done)
         self.exiting = True
 
-    def move(self, target, speed=5):
-        self.target_rect = target
-        self.speed = speed
+    def move(self, pos):
+        """Walks to pos. Characters share one floor, so only x is animated and y snaps."""
+        slot = self.slots.pop("y", None)
+        if slot is not None:
+            self.tweens.cancel(slot)
+        self.y = pos[1]
+        if pos[0] != self.x or "x" in self.slots:
+            self.animate("x", pos[0])
+
+    def settle(self):
+        """Jumps every animated property straight to its end."""
+        for slot in list(self.slots.values()):
+            self.tweens.finish(slot)
+        self.rect.topleft = (self.x, self.y)
 
 
 class Scene:
@@ -152,379 +342,441 @@ class Scene:
 
         self.rect = pygame.Rect((0, 0), self.res)
 
+        self.renderer = renderer.ScaledRenderer(self.res)
+        self.dirty_rects = []
+
         self.backgrounds = {}
 
+        self.tweens = tween.Tweener()
         self.characters = {}
         self.on_screen_characters = []
 
-        with open((source),"rb") as scene_file:
-            scene = json.load(scene_file)
-            self.prefix = scene["prefix"]
-
-        with open(self.prefix + scene["characters"]) as character_file:
-            characters = json.load(character_file)
-
-        with open(self.prefix + scene["backgrounds"]) as background_file:
-            backgrounds = json.load(background_file)
-
-        with open(self.prefix + scene["soundtrack"]) as soundtrack_file:
-            self.soundtrack = json.load(soundtrack_file)
-
-        with open(self.prefix + scene["start"]) as start_script_file:
-            self.script = json.load(start_script_file)
+        scene = preload.prefetcher.get(("scene", source), load_scene_data, source)
+        self.prefix = scene["prefix"]
+        self.manifest = scene["manifest"]
+        characters = scene["characters"]
+        backgrounds = scene["backgrounds"]
+        self.soundtrack = scene["soundtrack"]
 
         for background, path in backgrounds.items():
-            self.backgrounds[background] = pygame.image.load(path)
-
-        self.background = self.backgrounds["Prologue"]
+            self.backgrounds[background] = assets.LazyImage(path, alpha=False, size=self.res)
 
         for name, character in characters.items():
-            self.characters[name] = Character(character[0], character[1], character[2])
-
+            self.characters[name] = Character(character[0], character[1], character[2], self.tweens)
+
+        self.compiler = script.ScriptCompiler(self.characters, self.backgrounds, self.soundtrack)
+        self.handlers = {
+            script.Op.BACKGROUND: self.op_background,
+            script.Op.MUSIC: self.op_music,
+            script.Op.ENTER: self.op_enter,
+            script.Op.EXIT: self.op_exit,
+            script.Op.SAVE: self.op_save,
+            script.Op.DIALOGUE: self.op_dialogue,
+            script.Op.THOUGHT: self.op_thought,
+            script.Op.ACTION: self.op_action,
+            script.Op.LOOK: self.op_look,
+            script.Op.AFFINITY: self.op_stat,
+            script.Op.INFAMY: self.op_stat,
+            script.Op.ABILITY: self.op_stat,
+            script.Op.REPUTATION: self.op_stat,
+            script.Op.TRUST: self.op_stat,
+            script.Op.MONEY: self.op_stat,
+            script.Op.UPDATE: self.op_update,
+            script.Op.ITEM: self.op_item,
+            script.Op.CHOICE: self.op_choice,
+            script.Op.BCHOICE: self.op_bchoice,
+            script.Op.END: self.op_end,
+            script.Op.SOUND: self.op_sound,
+        }
+
+        self.script_file = scene["start_file"]
+        self.script = self.compiler.compile(scene["start"], source)
         self.script_index = 0
+        self.op_index = 0
+        self.resume_op = 0  # first action of the next step, when restored mid-step
+        self.lookahead = LOOKAHEAD
+        self.warmed_index = 0
 
-        self.text_box = TextBox(
-            (0, 650),
-            "data/images/textbox.png",
-            ("data/fonts/Amiko-Regular.ttf", "data/fonts/Amiko-Bold.ttf"),
-            (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21)))
-        )
+        self.text_box = self.new_text_box("dialogue")
+        self.text_state = ("dialogue", None, None)  # show_text() arguments of the text on screen
+
+        self.save_slot = None  # slot "save" actions write to; set by the game, None saves nothing
 
         self.choice_buttons = []
+        self.choice_grid = buttons.ButtonGrid()
         self.choice_point = False
-        self.affinity_points={}
-        self.infamy_points=0
-        self.money=0
-        self.ability_points=0
-        self.class_reputation=0
-        self.kaiser_trust=0
+        self.stats = stats.StatLedger()
+
+        self.skipped = None  # while skip_read() runs: what to show once it stops, see present()
+        self.history = rollback.History()
+
+        self.background_name = None
+        self.background = None
+        self.music_track = None
+        if "state" in scene:
+            self.restore(scene["state"])
+        else:
+            self.op_background("Prologue", self.backgrounds["Prologue"])
+
+        self.prefetch_branches()
+        self.warm_ahead()
 
     def update(self, dt):
-        for character in self.on_screen_characters:
-                character.update(dt)
-                if character.exiting and not character.rect.colliderect(self.rect):
-                    self.on_screen_characters.remove(character)
-        self.text_box.update(dt)
+        self.tweens.update(dt)
+        with profiler.profiler.phase("text"):
+            self.text_box.update(dt)
 
     def get_surface(self):
-        return_surface = pygame.Surface(self.res)
+        """Redraws only what changed since the last call; the regions are left in self.dirty_rects."""
+        layers = self.renderer
+        layers.begin()
 
-        return_surface.blit(self.background, (0, 0))
+        layers.add("background", self.background, self.rect)
 
         for character in self.on_screen_characters:
                 surface, rect = character.get_surface()
-                return_surface.blit(surface, rect)
+                layers.add(character, surface, rect)
 
-        textbox_surface, textbox_rect = self.text_box.get_surface()
-        return_surface.blit(textbox_surface, textbox_rect)
+        for part, surface, rect, version, changed in self.text_box.get_layers():
+            layers.add(("text_box", part), surface, rect, version, changed)
 
         if self.choice_point:
             for button in self.choice_buttons:
                 surface, rect = button.get_surface()
-                return_surface.blit(surface, rect)
+                layers.add(button, surface, rect, button.state)
+
+        self.dirty_rects = layers.render()
+        return layers.surface, layers.output
+
+    def invalidate(self):
+        self.renderer.mark_all()
 
-        return return_surface, self.rect
+    def is_animating(self):
+        if self.text_box.text_scrolling:
+            return True
+        return self.tweens.busy()
 
     def step(self):
+        return self.recorded(self.run_step)
+
+    def run_step(self):
         try:
             actions = self.script[self.script_index]
         except IndexError:
             print("Script ends without an ending action!")
-            actions = []
-
-        for action in actions:
-            action_type = action[0]
-            data = action[1]
-            if action_type == "background":
-                self.background = self.backgrounds[data]
-            elif action_type == "music":
-                pygame.mixer.music.load(self.soundtrack[data])
-                pygame.mixer.music.play()
-            elif action_type == "enter":
-                self.characters[data[0]].set_sprite(data[1])
-                self.on_screen_characters.append(self.characters[data[0]])
-                align_characters(self.res, 800, 50, self.on_screen_characters)
-            elif action_type == "exit":
-                char_key = data
-                self.characters[char_key].exit()
-            elif action_type == "save":
-                dict = {
-                    "name": "Visual Novel",
-                    "prefix": "data/01/",
-                    "backgrounds": "backgrounds.json",
-                    "characters": "characters.json",
-                    "soundtrack": "soundtrack.json",
-                    "start": data
-                    }
-                f = open("data/01/save.json","w")
-                f.write(json.dumps(dict))
-                f.close()
-            elif action_type == "dialogue":
-                self.text_box = TextBox(
-                 (0, 650),
-                 "data/images/textbox.png",
-                 ("data/fonts/Amiko-Regular.ttf", "data/fonts/Amiko-Bold.ttf"),
-                (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21)))
-                )
-                character = data[0]
-                dialogue = data[1]
-                character = self.characters[character]
-                self.text_box.set_character(character.name, character.text_color)
-                self.text_box.set_text(dialogue)
-            elif action_type == "thought":
-                self.text_box = TextBox(
-                (0, 650),
-                "data/images/textbox.png",
-                ("data/fonts/Arimo-Italic-Latin.ttf", "data/fonts/Amiko-Bold.ttf"),
-                (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21)))
-                )
-                character = data[0]
-                thought = data[1]
-                character = self.characters[character]
-                self.text_box.set_character(character.name, character.text_color)
-                self.text_box.set_text(thought)
-            elif action_type == "action":
-                self.text_box = TextBox(
-                (0, 650),
-                "data/images/textbox.png",
-                ("data/fonts/Bam.TTF", "data/fonts/Amiko-Bold.ttf"),
-                (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21)))
-                )
-                character = data[0]
-                action = data[1]
-                character = self.characters[character]
-                self.text_box.set_character(character.name, character.text_color)
-                self.text_box.set_text(action)
-            elif action_type == "look":
-                character = data[0]
-                new_sprite = data[1]
-                self.characters[character].set_sprite(new_sprite)
-            elif action_type == "affinity":
-                self.text_box = TextBox(
-                (0, 650),
-                "data/images/textbox.png",
-                ("data/fonts/Amiko-SemiBold.ttf", "data/fonts/Amiko-Bold.ttf"),
-                (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21))),(25, 25)
-                )
-                character="effect"
-                char= data[0]
-                points = data[1]
-                ope=data[2]
-                affinity= 'Affinity Points:'+ ope + points + "  "+char
-                if char in self.affinity_points:
-                    if ope == "+":
-                        newpoint=int(self.affinity_points[char])+int(points)
-                        self.affinity_points[char]=str(newpoint)
-                    elif ope == "-":
-                        newpoint=int(self.affinity_points[char])-int(points)
-                        self.affinity_points[char]=str(newpoint)
-                else:
-                    if ope == "+":
-                        self.affinity_points[char]=int(points)
-                    elif ope == "-":
-                        points=-int(points)
-                        self.affinity_points[char]=points
-                character = self.characters[character]
-                self.text_box.set_character(character.name, character.text_color)
-                self.text_box.set_text(affinity)
-            elif action_type == "infamy":
-                self.text_box = TextBox(
-                (0, 650),
-                "data/images/textbox.png",
-                ("data/fonts/Amiko-SemiBold.ttf", "data/fonts/Amiko-Bold.ttf"),
-                (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21))), (25, 25)
-                )
-                character="effect"
-                points =data[0]
-                ope=data[1]
-                infamy= 'Infamy Points:'+ ope + points
-                if ope == "+":
-                    self.infamy_points+=int(points)
-                elif ope == "-":
-                    self.infamy_points-=int(points)
-                character = self.characters[character]
-                self.text_box.set_character(character.name, character.text_color)
-                self.text_box.set_text(infamy)
-            elif action_type == "ability":
-                self.text_box = TextBox(
-                (0, 650),
-                "data/images/textbox.png",
-                ("data/fonts/Amiko-SemiBold.ttf", "data/fonts/Amiko-Bold.ttf"),
-                (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21))), (25, 25)
-                )
-                character="effect"
-                points = data[0]
-                ope=data[1]
-                ability= 'Ability Points:'+ ope + points
-                if ope == "+":
-                    self.ability_points+=int(points)
-                elif ope == "-":
-                    self.ability_points-=int(points)
-                character = self.characters[character]
-                self.text_box.set_character(character.name, character.text_color)
-                self.text_box.set_text(ability)
-            elif action_type == "reputation":
-                self.text_box = TextBox(
-                (0, 650),
-                "data/images/textbox.png",
-                ("data/fonts/Amiko-SemiBold.ttf", "data/fonts/Amiko-Bold.ttf"),
-                (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21))), (25, 25)
-                )
-                character="effect"
-                points = data[0]
-                ope=data[1]
-                reputation= 'Class Reputation:'+ ope + points
-                if ope == "+":
-                    self.class_reputation+=int(points)
-                elif ope == "-":
-                    self.class_reputation-=int(points)
-                character = self.characters[character]
-                self.text_box.set_character(character.name, character.text_color)
-                self.text_box.set_text(reputation)
-            elif action_type == "trust":
-                self.text_box = TextBox(
-                (0, 650),
-                "data/images/textbox.png",
-                ("data/fonts/Amiko-SemiBold.ttf", "data/fonts/Amiko-Bold.ttf"),
-                (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21))), (25, 25)
-                )
-                character="effect"
-                points = data[0]
-                ope=data[1]
-                trust= "Kaiser's Trust:" + ope + points
-                if ope == "+":
-                    self.kaiser_trust+=int(points)
-                elif ope == "-":
-                    self.kaiser_trust-=int(points)
-                character = self.characters[character]
-                self.text_box.set_character(character.name, character.text_color)
-                self.text_box.set_text(trust)
-            elif action_type == "money":
-                self.text_box = TextBox(
-                (0, 650),
-                "data/images/textbox.png",
-                ("data/fonts/Amiko-SemiBold.ttf", "data/fonts/Amiko-Bold.ttf"),
-                (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21))), (25, 25)
-                )
-                character="effect"
-                points = data
-                self.money+=int(points)
-                money= 'You earned '+ points + ' yen for finshing this scene' 
-                character = self.characters[character]
-                self.text_box.set_character(character.name, character.text_color)
-                self.text_box.set_text(money)
-            elif action_type == "update":
-                self.text_box = TextBox(
-                (0, 650),
-                "data/images/textbox.png",
-                ("data/fonts/Amiko-SemiBold.ttf", "data/fonts/Amiko-Bold.ttf"),
-                (pygame.Rect((2, 27), (1278, 198)), pygame.Rect((2, 2), (96, 21))), (25, 25)
-                )
-                character="effect"
-                if 'money' in data:
-                    money = "Total Money:     " + str(self.money) + "  Yen"
-                    character = self.characters[character]
-                    self.text_box.set_character(character.name, character.text_color)
-                    self.text_box.set_text(money)
-                elif 'infamy' in data:
-                    infamy = "Total Infamy:     " + str(self.infamy_points) 
-                    character = self.characters[character]
-                    self.text_box.set_character(character.name, character.text_color)
-                    self.text_box.set_text(infamy)
-                elif 'reputation' in data:
-                    reputation = "Total Class Reputation:   " + str(self.class_reputation)
-                    character = self.characters[character]
-                    self.text_box.set_character(character.name, character.text_color)
-                    self.text_box.set_text(reputation)
-                elif 'ability' in data:
-                    ability = "Total Ability Points:    " + str(self.ability_points)
-                    character = self.characters[character]
-                    self.text_box.set_character(character.name, character.text_color)
-                    self.text_box.set_text(ability)
-                elif 'trust'  in data:
-                    trust = "Total Kaiser's Trust:   " + str(self.kaiser_trust)
-                    character = self.characters[character]
-                    self.text_box.set_character(character.name, character.text_color)
-                    self.text_box.set_text(trust)
-                elif 'affinity' in data:
-                    y=data[1]
-                    if y in self.affinity_points:
-                        affinity = "Total Affinity for " + y + " is " + str(self.affinity_points[y])
-                        self.text_box.set_text(affinity)
-            elif action_type == "item":
-                money=self.money
-                items = data
-                for item in items:
-                    item_button = buttons.TextButton(
-                        item[0],
-                        "data/fonts/Amiko-Bold.ttf",
-                        22,
-                        white,
-                        "data/images/bbutton.png"
-                    )
-                    if item[0] == "Exit Store" :
-                        item_button.action = self.make_choice_action(item[2])
-                        item_button.active = True
-                        self.choice_buttons.append(item_button)               
-                    if item[0] != "Exit Store":
-                        if money>0:
-                            item_button.action, money= self.make_purchase_action(item)
-                            item_button.active = True
-                            self.choice_buttons.append(item_button)
-                        else:
-                            item_button.active = False
-                d=100
-                for button in self.choice_buttons[::2]:
-                    button.set_pos((100, d))
-                    d+=100
-                d=100
-                for button in self.choice_buttons[1::2]:
-                    button.set_pos((680, d))
-                    d+=100
-                self.choice_point = True
-            elif action_type == "choice":
-                choices = data
-                for choice in choices:
-                    print("Choice: {0}".format(choice[0]))
-                    choice_button = buttons.TextButton(
-                        choice[0],
-                        "data/fonts/Amiko-Bold.ttf",
-                        22,
-                        white,
-                        "data/images/button.png"
-                    )
-                    choice_button.action = self.make_choice_action(choice[1])
-                    choice_button.active = True
-                    self.choice_buttons.append(choice_button)
-                align_buttons(self.res, 10, self.choice_buttons)
-                self.choice_point = True
-            elif action_type == "bchoice":
-                choices = data
-                for choice in choices:
-                    print("Choice: {0}".format(choice[0]))
-                    choice_button = buttons.TextButton(
-                        choice[0],
-                        "data/fonts/Amiko-Bold.ttf",
-                        22,
-                        white,
-                        "data/images/bbutton.png"
-                    )
-                    choice_button.action = self.make_choice_action(choice[1])
-                    choice_button.active = True
-                    self.choice_buttons.append(choice_button)
-                align_buttons(self.res, 10, self.choice_buttons)
-                self.choice_point = True
-            elif action_type == "end":
-                next_scene = Scene(data) if data != "" else None
-                return True, next_scene
-        self.script_index += 1
+            actions = ()
+
+        handlers = self.handlers
+        start, self.resume_op = self.resume_op, 0
+        readstate.log.mark(self.prefix + self.script_file, len(self.script), self.script_index)
+        with profiler.profiler.phase("step"):
+            for position in range(start, len(actions)):
+                op, args = actions[position]
+                self.op_index = position
+                result = handlers[op](*args)
+                if result is not None:
+                    return result
+            self.script_index += 1
+            self.warm_ahead()
         return False, None
 
+    def op_background(self, name, background):
+        self.background_name = name
+        self.present("background", self.show_background, background)
+
+    def show_background(self, background):
+        self.background = background.get()
+
+    def op_music(self, track):
+        self.music_track = track
+        self.present("music", audio.player.play_music, self.soundtrack[track])
+
+    def op_sound(self, track):
+        if self.skipped is None:
+            audio.player.play_sound(self.soundtrack[track])
+
+    def op_enter(self, character, sprite_key):
+        character.set_sprite(sprite_key)
+        character.exiting = False
+        if character not in self.on_screen_characters:
+            self.on_screen_characters.append(character)
+        align_characters(self.res, 800, 50, self.on_screen_characters)
+
+    def op_exit(self, character):
+        character.exit(lambda: self.remove_character(character))
+
+    def remove_character(self, character):
+        """Called when an exiting character has walked off screen."""
+        if character.exiting and character in self.on_screen_characters:
+            self.on_screen_characters.remove(character)
+            character.exiting = False
+
+    def op_save(self, start):
+        if self.save_slot is None:
+            return
+        data = dict(self.manifest)  # this chapter's name, prefix and manifest files
+        data["start"] = self.script_file
+        data["state"] = self.snapshot(self.op_index + 1)
+        saves.manager.save(self.save_slot, data, start)
+
+    def op_dialogue(self, character, dialogue):
+        self.show_text("dialogue", character, dialogue)
+
+    def op_thought(self, character, thought):
+        self.show_text("thought", character, thought)
+
+    def op_action(self, character, action):
+        self.show_text("action", character, action)
+
+    def op_look(self, character, sprite_key):
+        character.set_sprite(sprite_key)
+
+    def op_stat(self, character, stat, target, points, label):
+        self.stats.add(stat, points, target)
+        self.show_text("effect", character, label)
+
+    def op_update(self, character, kind, target):
+        if kind == "affinity" and not self.stats.has(kind, target):
+            self.show_text("effect", None, None)  # nothing to report yet
+            return
+        self.show_text("effect", character, UPDATE_TEXT[kind].format(self.stats.get(kind, target), target))
+
+    def op_item(self, items):
+        for label, price, effects, exit_file in items:
+            item_button = buttons.TextButton(
+                label,
+                "data/fonts/Amiko-Bold.ttf",
+                22,
+                white,
+                "data/images/bbutton.png"
+            )
+            if exit_file is not None:
+                item_button.action = self.make_choice_action(exit_file)
+            else:
+                item_button.action = self.make_purchase_action(price, effects)
+            item_button.price = price
+            self.choice_buttons.append(item_button)
+        self.update_shop()
+        d=100
+        for button in self.choice_buttons[::2]:
+            button.set_pos((100, d))
+            d+=100
+        d=100
+        for button in self.choice_buttons[1::2]:
+            button.set_pos((680, d))
+            d+=100
+        self.choice_grid = buttons.ButtonGrid(self.choice_buttons)
+        self.choice_point = True
+
+    def op_choice(self, choices, button_image="data/images/button.png"):
+        for label, file in choices:
+            print("Choice: {0}".format(label))
+            choice_button = buttons.TextButton(
+                label,
+                "data/fonts/Amiko-Bold.ttf",
+                22,
+                white,
+                button_image
+            )
+            choice_button.action = self.make_choice_action(file)
+            choice_button.active = True
+            self.choice_buttons.append(choice_button)
+        align_buttons(self.res, 10, self.choice_buttons)
+        self.choice_grid = buttons.ButtonGrid(self.choice_buttons)
+        self.choice_point = True
+
+    def op_bchoice(self, choices):
+        self.op_choice(choices, "data/images/bbutton.png")
+
+    def op_end(self, source):
+        preload.prefetcher.discard(self.compiler)  # branches this scene will no longer take
+        next_scene = Scene(source) if source is not None else None
+        if next_scene is not None:
+            next_scene.save_slot = self.save_slot
+        return True, next_scene
+
+    def snapshot(self, resume_op=0):
+        """Returns the whole game state as a small JSON-serializable dict.
+
+        Playback resumes at action resume_op of the current step, so a save
+        taken mid-step does not apply that step's earlier actions twice.
+        """
+        characters = []
+        for key, character in self.characters.items():
+            if character in self.on_screen_characters and not character.exiting:
+                characters.append([key, character.sprite_key])
+        return {
+            "version": SNAPSHOT_VERSION,
+            "script": self.script_file,
+            "index": self.script_index,
+            "op": resume_op,
+            "stats": self.stats.as_dict(),
+            "characters": characters,
+            "background": self.background_name,
+            "music": self.music_track,
+        }
+
+    def restore(self, state):
+        """Puts the scene back into a snapshot() state without replaying the script.
+
+        The current script must already be the snapshot's; only the
+        background and sprites on screen are loaded.
+        """
+        if state.get("version") == 1:
+            state = upgrade_snapshot(state)
+        if state.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("Unsupported save version: {0}".format(state.get("version")))
+        self.script_index = state["index"]
+        self.resume_op = state["op"]
+        self.warmed_index = self.script_index
+
+        self.stats = stats.StatLedger()
+        self.stats.load(state["stats"])
+        self.history.clear()  # its ledger marks belong to the old ledger
+
+        self.place_characters([(self.characters[key], sprite_key) for key, sprite_key in state["characters"]])
+
+        name = state["background"]
+        if name is not None:
+            self.op_background(name, self.backgrounds[name])
+        if state["music"] is not None:
+            self.op_music(state["music"])
+        self.invalidate()
+
+    def place_characters(self, characters):
+        """Puts characters, (character, sprite key) pairs, on screen in their places without walking there."""
+        for character in list(self.on_screen_characters):
+            character.settle()  # lets exits finish and remove_character run
+        self.on_screen_characters = []
+        for character, sprite_key in characters:
+            character.exiting = False
+            character.set_sprite(sprite_key)
+            self.on_screen_characters.append(character)
+        align_characters(self.res, 800, 50, self.on_screen_characters)
+        for character in self.on_screen_characters:
+            character.settle()
+
+    def rollback_state(self):
+        """The state a step, choice or purchase can change, for the rollback history."""
+        return {
+            "script": self.script,
+            "script_file": self.script_file,
+            "index": self.script_index,
+            "op": self.resume_op,
+            "stats": self.stats.mark(),
+            "background": self.background_name,
+            "music": self.music_track,
+            "characters": tuple((character, character.sprite_key) for character in self.on_screen_characters
+                                if not character.exiting),
+            "text": self.text_state,
+            "choices": (self.choice_point, tuple((button, button.active) for button in self.choice_buttons)),
+        }
+
+    def recorded(self, function, *args):
+        """Runs function(*args) as one entry of the rollback history, unless it is part of one already."""
+        if self.history.recording:
+            return function(*args)
+        self.history.begin(self.rollback_state())
+        try:
+            return function(*args)
+        finally:
+            self.history.end(self.rollback_state())
+
+    def roll_back(self):
+        """Undoes the last step, choice or purchase; returns False if there is nothing left to undo."""
+        delta = self.history.pop()
+        if delta is None:
+            return False
+        self.script = delta.get("script", self.script)
+        self.script_file = delta.get("script_file", self.script_file)
+        self.script_index = delta.get("index", self.script_index)
+        self.resume_op = delta.get("op", self.resume_op)
+        if "stats" in delta:
+            self.stats.rollback(delta["stats"])
+        if delta.get("background") is not None:
+            self.op_background(delta["background"], self.backgrounds[delta["background"]])
+        if "music" in delta:
+            if delta["music"] is None:
+                self.music_track = None
+                audio.player.stop_music()
+            else:
+                self.op_music(delta["music"])
+        if "characters" in delta:
+            self.place_characters(delta["characters"])
+        if "text" in delta:
+            self.text_state = delta["text"]
+            self.display_text(*self.text_state)
+            self.text_box.skip_scroll()  # it was read already
+        if "choices" in delta:
+            self.choice_point, choices = delta["choices"]
+            self.choice_buttons = []
+            for button, active in choices:
+                button.active = active
+                button.hovered = button.pressed = False
+                self.choice_buttons.append(button)
+            self.choice_grid = buttons.ButtonGrid(self.choice_buttons)
+        self.warmed_index = self.script_index
+        self.warm_ahead()
+        self.invalidate()
+        return True
+
+    def new_text_box(self, style):
+        return text_boxes.get(style)
+
+    def show_text(self, style, character, text):
+        """Shows text said by character in a style's text box; with no character the box is left empty."""
+        self.text_state = (style, character, text)
+        self.present("text", self.display_text, style, character, text)
+
+    def display_text(self, style, character, text):
+        self.text_box = self.new_text_box(style)
+        if character is not None:
+            self.text_box.set_character(character.name, character.text_color)
+            self.text_box.set_text(text)
+
+    def present(self, key, function, *args):
+        """Runs function(*args) to show something, or, during skip_read(), keeps it
+        to run when the skip stops, replacing what was kept earlier under key."""
+        if self.skipped is None:
+            function(*args)
+        else:
+            self.skipped[key] = (function, args)
+
+    def is_read(self):
+        """Whether the next step has been played before, in this or an earlier session."""
+        return readstate.log.is_read(self.prefix + self.script_file, len(self.script), self.script_index)
+
+    def skip_read(self):
+        """Fast-forwards through the steps the player has already read.
+
+        Steps are run without showing anything in between. Playback stops at
+        a choice, an ending or just after the first unread step. Then only the
+        last text, background and music are shown. Returns step()'s result.
+        """
+        result = False, None
+        self.skipped = {}
+        try:
+            while not self.choice_point:
+                read = self.is_read()
+                result = self.step()
+                if result[0] or not read:
+                    break
+        finally:
+            skipped, self.skipped = self.skipped, None
+        if not result[0]:
+            for function, args in skipped.values():
+                function(*args)
+            for character in list(self.on_screen_characters):
+                character.settle()
+        return result
+
+    def hover(self, pos):
+        if self.choice_point:
+            self.choice_grid.hover(pos)
+
     def click(self, pos):
         if self.choice_point:
-            for button in self.choice_buttons:
-                if button.hover(pos):
-                    button.press()
+            self.choice_grid.press(pos)
             return False, None
         else:
             if self.text_box.text_scrolling:
@@ -535,91 +787,136 @@ class Scene:
 
     def make_choice_action(self, file):
         def choice_action():
-            with open(self.prefix + file) as choice_script:
-                self.choice_point = False
-                self.script = json.load(choice_script)
-                self.script_index = 0
-                self.step()
+            path = self.prefix + file
+            self.choice_point = False
             self.choice_buttons = []
-        return choice_action
-
-    def make_purchase_action(self, item=[]):
-        character="effect"
-        character = self.characters[character]
-        self.text_box.set_character(character.name, character.text_color)
-        price=int(item[1])
-        effects= item[2]
-        x=int(self.money)
-        def choice_action():
-            if x<0:
-                self.text_box.set_text("You do not have enough money!")
-            elif x >= 0:
-                points=int(effects[1])
-                z=str(points)
-                if item[0]=="Bag of Books":
-                    self.ability_points+=points
-                    self.money-=price
-                    self.text_box.set_text("You have earned " + z + " ability points")
-                elif item[0]=="Bibimbap":
-                    if effects[2] in self.affinity_points:
-                        newpoint=int(self.affinity_points[effects[2] ])+int(points)
-                        self.affinity_points[effects[2]]=str(newpoint)
-                    else:
-                        self.affinity_points[effects[2]]=int(points)
-                    self.money-=price
-                    self.text_box.set_text("You have earned " + z + effects[2] +" affinity points")
-                elif item[0]=="Briefcase":
-                    self.kaiser_trust+=points
-                    self.money-=price
-                    self.text_box.set_text("You have earned " + z + " Kaiser's trust")
-                elif item[0]=="Chocolate Bar":
-                    if effects[2] in self.affinity_points:
-                        newpoint=int(self.affinity_points[effects[2] ])+int(points)
-                        self.affinity_points[effects[2]]=str(newpoint)
-                    else:
-                        self.affinity_points[effects[2]]=int(points)
-                    self.money-=price
-                    self.text_box.set_text("You have earned " + z + effects[2] +" affinity points")
-                elif item[0]=="Gelato":
-                    if effects[2] in self.affinity_points:
-                        newpoint=int(self.affinity_points[effects[2] ])+int(points)
-                        self.affinity_points[effects[2]]=str(newpoint)
-                    else:
-                        self.affinity_points[effects[2]]=int(points)
-                    self.money-=price
-                    self.text_box.set_text("You have earned " + z + effects[2] +" affinity points")
-                elif item[0]=="Surprise Gift":
-                    self.class_reputation+=points
-                    self.money-=price
-                    self.text_box.set_text("You have earned " + z + " class reputation")
-                elif item[0]=="Gingerbread Man":
-                    if effects[2] in self.affinity_points:
-                        newpoint=int(self.affinity_points[effects[2] ])+int(points)
-                        self.affinity_points[effects[2]]=str(newpoint)
-                    else:
-                        self.affinity_points[effects[2]]=int(points)
-                    self.money-=price
-                    self.text_box.set_text("You have earned " + z + effects[2] +" affinity points")
-                elif item[0]=="Ham":
-                    if effects[2] in self.affinity_points:
-                        newpoint=int(self.affinity_points[effects[2] ])+int(points)
-                        self.affinity_points[effects[2]]=str(newpoint)
-                    else:
-                        self.affinity_points[effects[2]]=int(points)
-                    self.money-=price
-                    self.text_box.set_text("You have earned " + z + effects[2] +" affinity points")
-                elif item[0]=="Shawarma":
-                    if effects[2] in self.affinity_points:
-                        newpoint=int(self.affinity_points[effects[2] ])+int(points)
-                        self.affinity_points[effects[2]]=str(newpoint)
-                    else:
-                        self.affinity_points[effects[2]]=int(points)
-                    self.money-=price
-                    self.text_box.set_text("You have earned " + z + effects[2] +" affinity points")
-                self.text_box.set_text("You have " + str(self.money) + " yen left")
-        return choice_action, self.money
+            self.choice_grid = buttons.ButtonGrid()
+            self.script = preload.prefetcher.get(self.script_key(path), self.load_script, path)
+            self.script_file = file
+            self.script_index = 0
+            self.warmed_index = 0
+            self.prefetch_branches()
+            self.step()
+        return lambda: self.recorded(choice_action)
+
+    def warm_ahead(self):
+        """Starts decoding the images used by the next self.lookahead steps."""
+        end = min(self.script_index + self.lookahead, len(self.script))
+        for actions in self.script[max(self.warmed_index, self.script_index):end]:
+            for op, args in actions:
+                if op == script.Op.BACKGROUND:
+                    args[1].warm()
+                elif op in (script.Op.ENTER, script.Op.LOOK):
+                    args[0].sprites[args[1]].warm()
+                elif op == script.Op.MUSIC:
+                    audio.player.preload(self.soundtrack[args[0]])
+        self.warmed_index = max(self.warmed_index, end)
+
+    def prefetch_branches(self):
+        """Starts loading every script or scene the current script can branch to,
+        and the first music track the script plays."""
+        first_track = True
+        for actions in self.script:
+            for op, args in actions:
+                if op == script.Op.MUSIC and first_track:
+                    audio.player.preload(self.soundtrack[args[0]])
+                    first_track = False
+                elif op in (script.Op.CHOICE, script.Op.BCHOICE):
+                    for label, file in args[0]:
+                        path = self.prefix + file
+                        preload.prefetcher.prefetch(self.script_key(path), self.load_script, path)
+                elif op == script.Op.ITEM:
+                    for item in args[0]:
+                        if item[3] is not None:
+                            path = self.prefix + item[3]
+                            preload.prefetcher.prefetch(self.script_key(path), self.load_script, path)
+                elif op == script.Op.END and args[0] is not None:
+                    preload.prefetcher.prefetch(("scene", args[0]), load_scene_data, args[0], True)
+
+    def script_key(self, path):
+        """Prefetch key of a script compiled for this scene.
+
+        Compiled scripts refer to this scene's characters and images, so the
+        compiler is part of the key: another Scene never claims them.
+        """
+        return ("script", path, self.compiler)
+
+    def load_script(self, path):
+        """Reads and compiles a script; safe to run on the prefetch thread."""
+        return self.compiler.compile(load_script(path), path)
+
+    def make_purchase_action(self, price, effects):
+        def purchase_action():
+            character = self.characters["effect"]
+            if self.stats.purchase(price, effects):
+                earned = ", ".join(EFFECT_TEXT[stat].format(points, target) for stat, points, target in effects)
+                text = "You have earned {0}. You have {1} yen left".format(earned, self.stats.get("money"))
+            else:
+                text = "You do not have enough money!"
+            self.show_text("effect", character, text)
+            self.update_shop()
+        return lambda: self.recorded(purchase_action)
+
+    def update_shop(self):
+        """Greys out the shop items that cost more than the money there is now.
+
+        Exit Store has no price and stays pressable, even with money below zero.
+        """
+        money = self.stats.get("money")
+        for button in self.choice_buttons:
+            button.active = button.price is None or button.price <= money
+
+
+def upgrade_snapshot(state):
+    """Converts a version 1 snapshot to the current layout."""
+    state = dict(state)
+    state["stats"] = dict((SNAPSHOT_V1_STATS[attribute], points) for attribute, points in state["stats"].items())
+    state["stats"]["affinity"] = state.pop("affinity")
+    state["version"] = 2
+    return state
+
+
+def load_script(path):
+    with assets.open_file(path) as script_file:
+        return json.load(script_file)
+
+
+def load_scene_data(source, decode_images=False):
+    """Reads a scene file along with the manifests and start script it names.
+
+    With decode_images the images shown by the first LOOKAHEAD steps of the
+    start script are decoded as well, for use from the prefetch thread.
+    """
+    with assets.open_file(source) as scene_file:
+        scene = json.load(scene_file)
+    prefix = scene["prefix"]
+
+    data = {"prefix": prefix, "start_file": scene["start"]}
+    # What a save needs to load this chapter again, from any script in it.
+    data["manifest"] = {"name": scene.get("name", "Visual Novel"), "prefix": prefix}
+    for key in ("characters", "backgrounds", "soundtrack"):
+        data["manifest"][key] = scene[key]
+    if "state" in scene:
+        data["state"] = scene["state"]
+    for key in ("characters", "backgrounds", "soundtrack", "start"):
+        data[key] = load_script(prefix + scene[key])
+
+    if decode_images:
+        backgrounds = data["backgrounds"]
+        characters = data["characters"]
+        assets.cache.predecode(backgrounds["Prologue"])
+        for actions in data["start"][:LOOKAHEAD]:
+            for action in actions:
+                if action[0] == "background":
+                    assets.cache.predecode(backgrounds[action[1]])
+                elif action[0] in ("enter", "look"):
+                    assets.cache.predecode(characters[action[1][0]][1][action[1][1]])
+    return data
+
 
 def align_characters(res, bottom, spacing, char_list):
+    # Characters walking off keep going; moving them would cancel the exit and its on_done.
+    char_list = [character for character in char_list if not character.exiting]
     total_width = -spacing
     max_height = 0
     for character in char_list:
@@ -636,8 +933,7 @@ def align_characters(res, bottom, spacing, char_list):
         rect = character.rect.copy()
         rect.bottomleft = (offset, bottom)
         offset = rect.right + spacing
-        character.y = rect.y
-        character.move(rect)
+        character.move(rect.topleft)
 
 
 def align_buttons(res, spacing, button_list):
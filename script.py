@@ -0,0 +1,214 @@
+import collections
+import enum
+
+import stats
+
+
+class Op(enum.IntEnum):
+    BACKGROUND = 0
+    MUSIC = 1
+    ENTER = 2
+    EXIT = 3
+    SAVE = 4
+    DIALOGUE = 5
+    THOUGHT = 6
+    ACTION = 7
+    LOOK = 8
+    AFFINITY = 9
+    INFAMY = 10
+    ABILITY = 11
+    REPUTATION = 12
+    TRUST = 13
+    MONEY = 14
+    UPDATE = 15
+    ITEM = 16
+    CHOICE = 17
+    BCHOICE = 18
+    END = 19
+    SOUND = 20
+
+
+OPCODES = {op.name.lower(): op for op in Op}
+
+# Stat actions: op -> (stat in stats.STATS, label shown in the text box)
+STAT_OPS = {
+    Op.INFAMY: ("infamy", "Infamy Points:"),
+    Op.ABILITY: ("ability", "Ability Points:"),
+    Op.REPUTATION: ("reputation", "Class Reputation:"),
+    Op.TRUST: ("trust", "Kaiser's Trust:"),
+}
+
+# Shop items whose effects were written before effects named their stat;
+# any other item without a known stat raises the affinity of its target.
+ITEM_STATS = {
+    "Bag of Books": "ability",
+    "Briefcase": "trust",
+    "Surprise Gift": "reputation",
+}
+
+# "update" summaries, checked in this order like the original action chain.
+UPDATE_KINDS = ("money", "infamy", "reputation", "ability", "trust", "affinity")
+
+Instruction = collections.namedtuple("Instruction", "op args")
+
+
+class ScriptError(ValueError):
+    """Raised when a script file cannot be compiled."""
+
+
+class ScriptCompiler:
+    """Turns the JSON action lists of a script into tuples of Instructions.
+
+    Character and background names are resolved, integer operands parsed and
+    the text shown by stat actions built ahead of time, so a malformed script
+    fails when it is loaded rather than when the player reaches the bad line.
+
+    characters maps a character key to an object with a `sprites` mapping,
+    backgrounds maps a name to whatever the caller wants stored for it.
+    Subclasses can override the resolve_* methods to record references
+    instead of resolving them.
+    """
+    def __init__(self, characters, backgrounds, soundtrack):
+        self.characters = characters
+        self.backgrounds = backgrounds
+        self.soundtrack = soundtrack
+
+    def compile(self, raw, name="<script>"):
+        if not isinstance(raw, list):
+            raise ScriptError("{0}: a script must be a list of steps".format(name))
+
+        steps = []
+        for step_index, actions in enumerate(raw):
+            if not isinstance(actions, list):
+                raise ScriptError("{0}: step {1} must be a list of actions".format(name, step_index))
+            step = []
+            for action_index, action in enumerate(actions):
+                try:
+                    step.append(self.compile_action(action))
+                except (ScriptError, KeyError, IndexError, TypeError, ValueError) as error:
+                    message = error.args[0] if isinstance(error, ScriptError) else repr(error)
+                    raise ScriptError("{0}: step {1}, action {2}: {3}".format(
+                        name, step_index, action_index, message))
+            steps.append(tuple(step))
+        return tuple(steps)
+
+    def compile_action(self, action):
+        if not isinstance(action, list) or len(action) != 2:
+            raise ScriptError("an action must be [type, data], got {0!r}".format(action))
+        action_type, data = action
+        try:
+            op = OPCODES[action_type]
+        except (KeyError, TypeError):
+            raise ScriptError("unknown action type {0!r}".format(action_type))
+
+        if op == Op.BACKGROUND:
+            return Instruction(op, (data, self.resolve_background(data)))
+        if op in (Op.MUSIC, Op.SOUND):
+            if data not in self.soundtrack:
+                raise ScriptError("unknown {0} track {1!r}".format(action_type, data))
+            return Instruction(op, (data,))
+        if op in (Op.ENTER, Op.LOOK):
+            character = self.resolve_character(data[0])
+            self.resolve_sprite(data[0], character, data[1])
+            return Instruction(op, (character, data[1]))
+        if op == Op.EXIT:
+            return Instruction(op, (self.resolve_character(data),))
+        if op == Op.SAVE:
+            return Instruction(op, (text(data),))
+        if op in (Op.DIALOGUE, Op.THOUGHT, Op.ACTION):
+            return Instruction(op, (self.resolve_character(data[0]), text(data[1])))
+        if op == Op.AFFINITY:
+            char, points, sign = data[0], data[1], data[2]
+            label = "Affinity Points:" + sign + points + "  " + char
+            return Instruction(op, (self.resolve_character("effect"), "affinity", text(char),
+                                    signed(points, sign), label))
+        if op in STAT_OPS:
+            points, sign = data[0], data[1]
+            stat, label = STAT_OPS[op]
+            return Instruction(op, (self.resolve_character("effect"), stat, None, signed(points, sign),
+                                    label + sign + points))
+        if op == Op.MONEY:
+            label = "You earned " + data + " yen for finshing this scene"
+            return Instruction(op, (self.resolve_character("effect"), "money", None, signed(data, "+"), label))
+        if op == Op.UPDATE:
+            for kind in UPDATE_KINDS:
+                if kind in data:
+                    target = text(data[1]) if kind == "affinity" else None
+                    return Instruction(op, (self.resolve_character("effect"), kind, target))
+            raise ScriptError("nothing to update in {0!r}".format(data))
+        if op == Op.ITEM:
+            items = []
+            for item in data:
+                if item[0] == "Exit Store":
+                    items.append((text(item[0]), None, None, self.resolve_script(item[2])))  # leaving is free
+                else:
+                    items.append((text(item[0]), signed(item[1], "+"), self.compile_effects(item), None))
+            return Instruction(op, (tuple(items),))
+        if op in (Op.CHOICE, Op.BCHOICE):
+            choices = tuple((text(choice[0]), self.resolve_script(choice[1])) for choice in data)
+            return Instruction(op, (choices,))
+        if op == Op.END:
+            return Instruction(op, (self.resolve_scene(data) if data != "" else None,))
+        raise ScriptError("unhandled action type {0!r}".format(action_type))
+
+    def compile_effects(self, item):
+        """Turns a shop item's effects into ((stat, points, target), ...).
+
+        An item declares one effect as [stat, points] or [stat, points, target]
+        (target is the character, for affinity), or a list of such effects.
+        """
+        if len(item) < 3 or not isinstance(item[2], list) or not item[2]:
+            raise ScriptError("shop item {0!r} has no effects".format(item[0]))
+        declared = item[2] if isinstance(item[2][0], list) else [item[2]]
+        effects = []
+        for effect in declared:
+            stat = effect[0] if effect[0] in stats.STATS else ITEM_STATS.get(item[0], "affinity")
+            target = None
+            if stat in stats.TARGETED:
+                if len(effect) < 3:
+                    raise ScriptError("{0} effect of {1!r} needs a character".format(stat, item[0]))
+                target = text(effect[2])
+            points = effect[1] if isinstance(effect[1], int) else signed(effect[1], "+")
+            effects.append((stat, points, target))
+        return tuple(effects)
+
+    def resolve_character(self, key):
+        try:
+            return self.characters[key]
+        except KeyError:
+            raise ScriptError("unknown character {0!r}".format(key))
+
+    def resolve_sprite(self, key, character, sprite_key):
+        if sprite_key not in character.sprites:
+            raise ScriptError("character {0!r} has no sprite {1!r}".format(key, sprite_key))
+
+    def resolve_background(self, name):
+        try:
+            return self.backgrounds[name]
+        except KeyError:
+            raise ScriptError("unknown background {0!r}".format(name))
+
+    def resolve_script(self, file):
+        return text(file)
+
+    def resolve_scene(self, source):
+        return text(source)
+
+
+def text(value):
+    if not isinstance(value, str):
+        raise ScriptError("expected a string, got {0!r}".format(value))
+    return value
+
+
+def signed(points, sign):
+    """Parses a points string with its '+'/'-' operator into a signed int."""
+    try:
+        value = int(text(points))
+    except ValueError:
+        raise ScriptError("expected an integer, got {0!r}".format(points))
+    if sign == "+":
+        return value
+    if sign == "-":
+        return -value
+    raise ScriptError("expected '+' or '-', got {0!r}".format(sign))
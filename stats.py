@@ -0,0 +1,119 @@
+"""Game stats: typed integer totals plus an append-only change log.
+
+Every stat in STATS has one total, except those in TARGETED, which keep one
+per character. Totals live in a packed array; each change is also appended
+to the log as (total index, delta), so totals, conditions and "update"
+summaries are plain lookups while the history of a playthrough stays
+available through mark() and changes_since(), and can be undone back to a
+mark with rollback().
+"""
+import array
+import operator
+
+STATS = ("money", "infamy", "ability", "reputation", "trust", "affinity")
+TARGETED = ("affinity",)  # kept per character
+
+COMPARISONS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+    ">=": operator.ge,
+    ">": operator.gt,
+}
+
+
+class StatLedger:
+    def __init__(self):
+        self.keys = {}  # (stat, target) -> index into totals
+        self.names = []  # index -> (stat, target)
+        self.totals = array.array("q")
+        self.created = array.array("l")  # index -> log position when it was created
+        self.log_keys = array.array("l")
+        self.log_deltas = array.array("q")
+        for stat in STATS:
+            if stat not in TARGETED:
+                self.index(stat)
+        self.fixed = len(self.names)  # totals that always exist
+
+    def index(self, stat, target=None):
+        key = (stat, target)
+        index = self.keys.get(key)
+        if index is None:
+            if stat not in STATS:
+                raise ValueError("unknown stat {0!r}".format(stat))
+            if (stat in TARGETED) != (target is not None):
+                raise ValueError("stat {0!r} given target {1!r}".format(stat, target))
+            index = self.keys[key] = len(self.names)
+            self.names.append(key)
+            self.totals.append(0)
+            self.created.append(len(self.log_keys))
+        return index
+
+    def add(self, stat, points, target=None):
+        index = self.index(stat, target)
+        self.totals[index] += points
+        self.log_keys.append(index)
+        self.log_deltas.append(points)
+
+    def get(self, stat, target=None):
+        index = self.keys.get((stat, target))
+        return 0 if index is None else self.totals[index]
+
+    def has(self, stat, target=None):
+        return (stat, target) in self.keys
+
+    def targets(self, stat):
+        """Returns {target: total} for a TARGETED stat."""
+        return dict((target, self.totals[index]) for (name, target), index in self.keys.items() if name == stat)
+
+    def check(self, stat, comparison, value, target=None):
+        """Evaluates a condition such as check("money", ">=", 30)."""
+        return COMPARISONS[comparison](self.get(stat, target), value)
+
+    def purchase(self, price, effects):
+        """Pays price and applies effects, (stat, points, target) each, if there is enough money."""
+        if self.get("money") < price:
+            return False
+        self.add("money", -price)
+        for stat, points, target in effects:
+            self.add(stat, points, target)
+        return True
+
+    def mark(self):
+        """A position in the log, for changes_since()."""
+        return len(self.log_keys)
+
+    def changes_since(self, mark):
+        """Yields (stat, target, delta) for every change logged after mark."""
+        for position in range(mark, len(self.log_keys)):
+            stat, target = self.names[self.log_keys[position]]
+            yield stat, target, self.log_deltas[position]
+
+    def rollback(self, mark):
+        """Undoes every change logged after mark, forgetting targets first seen after it."""
+        for position in range(len(self.log_keys) - 1, mark - 1, -1):
+            self.totals[self.log_keys[position]] -= self.log_deltas[position]
+        del self.log_keys[mark:]
+        del self.log_deltas[mark:]
+        while len(self.names) > self.fixed and self.created[-1] >= mark:
+            del self.keys[self.names.pop()]
+            self.totals.pop()
+            self.created.pop()
+
+    def as_dict(self):
+        """The totals as JSON-serializable data: {stat: total}, with {target: total} for TARGETED stats."""
+        data = dict((stat, self.targets(stat)) for stat in TARGETED)
+        for (stat, target), index in self.keys.items():
+            if target is None:
+                data[stat] = self.totals[index]
+        return data
+
+    def load(self, data):
+        """Adds the totals of an as_dict() result, logged as ordinary changes."""
+        for stat, value in data.items():
+            if stat in TARGETED:
+                for target, points in value.items():
+                    self.add(stat, points, target)
+            else:
+                self.add(stat, value)
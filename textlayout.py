@@ -0,0 +1,75 @@
+import collections
+
+import assets
+
+LAYOUT_CACHE_SIZE = 512  # wrapped paragraphs remembered per font
+
+
+class TextLayout:
+    """Word wrapping for one font that measures every distinct word only once.
+
+    Whole layouts are memoized by (text, width), so showing the same line
+    again costs a dictionary lookup.
+    """
+    def __init__(self, font):
+        self.font = font
+        self.space_width = font.size(' ')[0]
+
+        self.word_widths = {}
+        self.layouts = collections.OrderedDict()
+
+    def measure(self, words):
+        """Returns the pixel widths of words, calling Font.size only for unseen ones."""
+        word_widths = self.word_widths
+        widths = []
+        for word in words:
+            width = word_widths.get(word)
+            if width is None:
+                width = word_widths[word] = self.font.size(word)[0]
+            widths.append(width)
+        return widths
+
+    def wrap(self, text, max_width):
+        """Breaks text into a tuple of lines no wider than max_width, keeping explicit newlines.
+
+        A single word wider than max_width gets a line of its own.
+        """
+        key = (text, max_width)
+        try:
+            self.layouts.move_to_end(key)
+            return self.layouts[key]
+        except KeyError:
+            pass
+
+        lines = []
+        for paragraph in text.split('\n'):
+            words = paragraph.split()
+            line = []
+            line_width = 0
+            for word, width in zip(words, self.measure(words)):
+                if line and line_width + self.space_width + width > max_width:
+                    lines.append(' '.join(line))
+                    line = []
+                    line_width = 0
+                if line:
+                    line_width += self.space_width
+                line.append(word)
+                line_width += width
+            lines.append(' '.join(line))
+
+        lines = tuple(lines)
+        self.layouts[key] = lines
+        if len(self.layouts) > LAYOUT_CACHE_SIZE:
+            self.layouts.popitem(last=False)
+        return lines
+
+
+layouts = {}  # (font path, size) -> TextLayout
+
+
+def get_layout(font_path, size):
+    key = (font_path, size)
+    layout = layouts.get(key)
+    if layout is None:
+        layout = layouts[key] = TextLayout(assets.load_font(font_path, size))
+    return layout
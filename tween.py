@@ -0,0 +1,131 @@
+"""Fixed-timestep tweens for character position, alpha and scale.
+
+Every tween is a scalar going from a start to an end value over a duration,
+eased out. All of a Tweener's tweens live in packed arrays indexed by slot
+and are advanced together: update() turns the elapsed time into whole
+STEP_MS steps and moves every tween by that many steps in one pass, so
+where an animation is at a given moment does not depend on the frame rate.
+The pass is vectorized with NumPy when it is installed.
+
+Finished tweens are reported through their on_done callback, called after
+the pass, in slot order.
+"""
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+STEP_MS = 1000.0 / 120  # fixed simulation step
+
+
+def ease_out(t):
+    return 1 - (1 - t) ** 3
+
+
+class Tweener:
+    def __init__(self, capacity=16):
+        self.capacity = 0
+        if numpy is not None:
+            self.starts = numpy.zeros(0)
+            self.deltas = numpy.zeros(0)
+            self.elapsed = numpy.zeros(0)
+            self.durations = numpy.ones(0)
+            self.values = numpy.zeros(0)
+            self.live = numpy.zeros(0, dtype=bool)
+        else:
+            self.starts = array.array("d")
+            self.deltas = array.array("d")
+            self.elapsed = array.array("d")
+            self.durations = array.array("d")
+            self.values = array.array("d")
+        self.callbacks = {}  # live slot -> on_done
+        self.free = []
+        self.remainder = 0.0  # ms not yet turned into a whole step
+        self.grow(capacity)
+
+    def grow(self, capacity):
+        added = capacity - self.capacity
+        if numpy is not None:
+            self.starts = numpy.concatenate((self.starts, numpy.zeros(added)))
+            self.deltas = numpy.concatenate((self.deltas, numpy.zeros(added)))
+            self.elapsed = numpy.concatenate((self.elapsed, numpy.zeros(added)))
+            self.durations = numpy.concatenate((self.durations, numpy.ones(added)))
+            self.values = numpy.concatenate((self.values, numpy.zeros(added)))
+            self.live = numpy.concatenate((self.live, numpy.zeros(added, dtype=bool)))
+        else:
+            for values in (self.starts, self.deltas, self.elapsed, self.values):
+                values.extend([0.0] * added)
+            self.durations.extend([1.0] * added)
+        self.free.extend(range(capacity - 1, self.capacity - 1, -1))
+        self.capacity = capacity
+
+    def start(self, start, end, duration, on_done=None):
+        """Starts a tween and returns its slot."""
+        if not self.free:
+            self.grow(self.capacity * 2)
+        slot = self.free.pop()
+        self.starts[slot] = start
+        self.deltas[slot] = end - start
+        self.elapsed[slot] = 0.0
+        self.durations[slot] = max(duration, STEP_MS)
+        self.values[slot] = start
+        if numpy is not None:
+            self.live[slot] = True
+        self.callbacks[slot] = on_done
+        return slot
+
+    def value(self, slot):
+        return float(self.values[slot])
+
+    def release(self, slot):
+        if numpy is not None:
+            self.live[slot] = False
+        self.free.append(slot)
+        return self.callbacks.pop(slot)
+
+    def cancel(self, slot):
+        """Stops a tween where it is, without calling on_done."""
+        self.release(slot)
+
+    def finish(self, slot):
+        """Jumps a tween to its end and calls on_done."""
+        self.values[slot] = self.starts[slot] + self.deltas[slot]
+        on_done = self.release(slot)
+        if on_done is not None:
+            on_done()
+
+    def busy(self):
+        return bool(self.callbacks)
+
+    def update(self, dt):
+        if not self.callbacks:
+            self.remainder = 0.0  # nothing to animate; do not bank idle time
+            return
+        self.remainder += dt
+        steps = int(self.remainder // STEP_MS)
+        if not steps:
+            return
+        self.remainder -= steps * STEP_MS
+        advance = steps * STEP_MS
+
+        if numpy is not None:
+            numpy.add(self.elapsed, advance, out=self.elapsed, where=self.live)
+            progress = numpy.minimum(self.elapsed / self.durations, 1.0)
+            numpy.add(self.starts, self.deltas * ease_out(progress), out=self.values, where=self.live)
+            finished = numpy.flatnonzero(self.live & (progress >= 1.0)).tolist()
+        else:
+            finished = []
+            for slot in sorted(self.callbacks):
+                elapsed = self.elapsed[slot] + advance
+                self.elapsed[slot] = elapsed
+                progress = min(elapsed / self.durations[slot], 1.0)
+                self.values[slot] = self.starts[slot] + self.deltas[slot] * ease_out(progress)
+                if progress >= 1.0:
+                    finished.append(slot)
+
+        # Free every finished slot first, so callbacks can start new tweens safely.
+        for on_done in [self.release(slot) for slot in finished]:
+            if on_done is not None:
+                on_done()
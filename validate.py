@@ -0,0 +1,243 @@
+"""Offline checker for scenes and scripts.
+
+Walks every data/*/scene.json (or the scene files given on the command
+line), follows each script reachable through choice, bchoice, item and end
+actions, and reports dangling references and files nothing reaches.
+
+    python validate.py [--json] [--strict] [scene.json ...]
+
+Exits with status 1 if there are errors (or warnings, with --strict).
+Does not need pygame or a display.
+"""
+import argparse
+import collections
+import glob
+import json
+import os
+import sys
+
+import script
+
+MANIFESTS = ("characters", "backgrounds", "soundtrack", "start")
+
+
+class CharacterRef:
+    def __init__(self, key, name, sprites):
+        self.key = key
+        self.name = name
+        self.sprites = sprites
+
+
+class IndexingCompiler(script.ScriptCompiler):
+    """ScriptCompiler that records every asset and script an action refers to."""
+    def __init__(self, index, characters, backgrounds, soundtrack):
+        super(IndexingCompiler, self).__init__(characters, backgrounds, soundtrack)
+        self.index = index
+        self.location = ""
+
+    def compile_action(self, action):
+        instruction = super(IndexingCompiler, self).compile_action(action)
+        if instruction.op == script.Op.MUSIC:
+            self.index.use(self.soundtrack[instruction.args[0]], "music", self.location)
+        elif instruction.op == script.Op.SOUND:
+            self.index.use(self.soundtrack[instruction.args[0]], "sound", self.location)
+        return instruction
+
+    def resolve_sprite(self, key, character, sprite_key):
+        super(IndexingCompiler, self).resolve_sprite(key, character, sprite_key)
+        self.index.use(character.sprites[sprite_key], "sprite", self.location)
+
+    def resolve_background(self, name):
+        path = super(IndexingCompiler, self).resolve_background(name)
+        self.index.use(path, "background", self.location)
+        return path
+
+
+class Index:
+    """Everything the checked content refers to, plus the problems found on the way."""
+    def __init__(self):
+        self.assets = {}  # path -> kind
+        self.used_by = collections.defaultdict(set)  # path -> locations
+        self.declared = {}  # image path -> (manifest, description) for every manifest entry
+        self.scenes = []
+        self.scripts = []
+        self.errors = []
+        self.warnings = []
+
+    def use(self, path, kind, location):
+        self.assets.setdefault(path, kind)
+        self.used_by[path].add(location)
+
+    def error(self, location, message):
+        self.errors.append("{0}: {1}".format(location, message))
+
+    def warning(self, location, message):
+        self.warnings.append("{0}: {1}".format(location, message))
+
+    def as_dict(self):
+        return {
+            "scenes": self.scenes,
+            "scripts": self.scripts,
+            "assets": {path: {"kind": kind, "used_by": sorted(self.used_by[path])}
+                       for path, kind in sorted(self.assets.items())},
+            "errors": self.errors,
+            "warnings": self.warnings,
+        }
+
+
+def read_json(path, index, location):
+    if not os.path.isfile(path):
+        return None  # reported once by check_files
+    try:
+        with open(path, "rb") as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError) as error:
+        index.error(location, "cannot read {0}: {1}".format(path, error))
+        return None
+
+
+def check_scene(source, index, location="<command line>"):
+    if source in index.scenes:
+        return
+    index.scenes.append(source)
+    index.use(source, "scene", location)
+
+    scene = read_json(source, index, location)
+    if scene is None:
+        return
+    try:
+        prefix = scene["prefix"]
+        manifest_paths = {key: prefix + scene[key] for key in MANIFESTS}
+    except (KeyError, TypeError) as error:
+        index.error(source, "missing scene key {0}".format(error))
+        return
+
+    manifests = {}
+    for key, path in manifest_paths.items():
+        if key != "start":
+            index.use(path, key, source)
+            manifests[key] = read_json(path, index, source)
+    if None in manifests.values():
+        return
+
+    characters = {}
+    for key, character in manifests["characters"].items():
+        characters[key] = CharacterRef(key, character[0], character[1])
+    backgrounds = manifests["backgrounds"]
+    soundtrack = manifests["soundtrack"]
+    if "Prologue" not in backgrounds:
+        index.error(manifest_paths["backgrounds"], "no 'Prologue' background (every scene opens on it)")
+
+    compiler = IndexingCompiler(index, characters, backgrounds, soundtrack)
+    pending = [(manifest_paths["start"], source)]
+    seen = set()
+    next_scenes = []
+    while pending:
+        path, location = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        index.use(path, "script", location)
+        if path not in index.scripts:
+            index.scripts.append(path)
+        raw = read_json(path, index, location)
+        if raw is None:
+            continue
+        if not isinstance(raw, list):
+            index.error(path, "a script must be a list of steps")
+            continue
+
+        for step_index, actions in enumerate(raw):
+            for action_index, action in enumerate(actions if isinstance(actions, list) else [actions]):
+                compiler.location = "{0}: step {1}, action {2}".format(path, step_index, action_index)
+                try:
+                    op, args = compiler.compile_action(action)
+                except (script.ScriptError, KeyError, IndexError, TypeError, ValueError) as error:
+                    message = error.args[0] if isinstance(error, script.ScriptError) else repr(error)
+                    index.error(compiler.location, message)
+                    continue
+                if op in (script.Op.CHOICE, script.Op.BCHOICE):
+                    for label, file in args[0]:
+                        pending.append((prefix + file, compiler.location))
+                elif op == script.Op.ITEM:
+                    for item in args[0]:
+                        if item[3] is not None:
+                            pending.append((prefix + item[3], compiler.location))
+                elif op == script.Op.END and args[0] is not None:
+                    next_scenes.append((args[0], compiler.location))
+
+    if "Prologue" in backgrounds:
+        index.use(backgrounds["Prologue"], "background", source)
+    for key, character in characters.items():
+        for sprite_key, path in character.sprites.items():
+            index.declared[path] = (manifest_paths["characters"], "sprite {0}/{1}".format(key, sprite_key))
+    for name, path in backgrounds.items():
+        index.declared[path] = (manifest_paths["backgrounds"], "background {0!r}".format(name))
+
+    for next_source, location in next_scenes:
+        check_scene(next_source, index, location)
+
+
+def check_files(index):
+    for path, kind in sorted(index.assets.items()):
+        if not os.path.isfile(path):
+            for location in sorted(index.used_by[path]):
+                index.error(location, "missing {0} file {1}".format(kind, path))
+
+
+def check_unused(index):
+    """Warns about manifest entries that no reachable script ever shows."""
+    for path, (manifest, description) in sorted(index.declared.items()):
+        if path not in index.assets:
+            index.warning(manifest, "{0} is never shown".format(description))
+
+
+def check_unreachable(index):
+    """Warns about JSON files in a scene directory that no scene or script reaches."""
+    directories = set(os.path.dirname(path) for path in index.scenes)
+    for directory in sorted(directories):
+        for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+            if path in index.assets or os.path.basename(path) == "save.json":
+                continue
+            index.warning(path, "not reachable from any scene")
+
+
+def validate(sources):
+    index = Index()
+    for source in sources:
+        check_scene(source, index)
+    check_files(index)
+    check_unused(index)
+    check_unreachable(index)
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check scene and script files for dangling references.")
+    parser.add_argument("scenes", nargs="*", help="scene files to start from (default: data/*/scene.json)")
+    parser.add_argument("--json", action="store_true", help="print the asset index and problems as JSON")
+    parser.add_argument("--strict", action="store_true", help="treat warnings as errors")
+    args = parser.parse_args(argv)
+
+    sources = args.scenes or sorted(glob.glob("data/*/scene.json"))
+    if not sources:
+        parser.error("no scene files found")
+    index = validate(sources)
+
+    if args.json:
+        print(json.dumps(index.as_dict(), indent=2))
+    else:
+        for message in index.errors:
+            print("error: " + message)
+        for message in index.warnings:
+            print("warning: " + message)
+        print("{0} scenes, {1} scripts, {2} assets: {3} errors, {4} warnings".format(
+            len(index.scenes), len(index.scripts), len(index.assets), len(index.errors), len(index.warnings)))
+
+    if index.errors or (args.strict and index.warnings):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,8 +4,19 @@
 #Heeler, Esel Nanci
 #2018-04217
 
+import glob
+import os
+import time
 import pygame
+import assets
+import audio
 import buttons
+import preload
+import profiler
+import readstate
+import renderer
+import rollback
+import saves
 import scenes
 
 pygame.init()
@@ -14,136 +25,254 @@ GAME_MAINMENU = 0
 GAME_RUNNING = 1
 GAME_PAUSED = 2
 
+FPS = 60  # frame-rate cap while something is animating
+IDLE_TIMEOUT = 500  # ms to block waiting for input when nothing is animating
+MAX_FRAME_TIME = 100  # ms, longest dt handed to update after waking from idle
+
+MAX_SLOTS_SHOWN = 8  # most recent save slots listed by "Load Game"
+
+WAKE_EVENT = pygame.USEREVENT  # posted to leave idle mode without user input
+
 black = (0, 0, 0)
 blue = (0, 0, 255)
 white = (255, 255, 255)
 
 
 class GameObject:
-    def __init__(self, width, height, caption):
+    def __init__(self, width, height, caption, fps=FPS, window_size=None):
         self.display_width = width
         self.display_height = height
-        self.display = pygame.display.set_mode((self.display_width, self.display_height))
+        self.logical_size = (width, height)  # everything is laid out at this size, then scaled to the window
+        self.display = pygame.display.set_mode(window_size or self.logical_size, pygame.RESIZABLE)
         pygame.display.set_caption(caption)
 
-        pygame.mixer.music.set_volume(0.25)
-
         self.clock = pygame.time.Clock()
+        self.fps = fps
+        self.awake = True  # forces at least one full frame before idling again
 
         self.state = ""
 
         self.scene = None
 
-        self.button_list = []
         self.menu = None
+        self.menu_version = None  # menu surface version on screen
+
+        self.overlay_rect = pygame.Rect(0, 0, 0, 0)
+
+        self.resize(self.display.get_size())
 
     @staticmethod
     def exit():
+        saves.manager.flush()
+        readstate.log.flush()
+        preload.prefetcher.shutdown()
+        if profiler.profiler.enabled:
+            profiler.profiler.write_trace()
         pygame.quit()
         quit()
 
-    def main_menu(self, dt):
-        """function for the main menu interface"""
-        mouse_pos = pygame.mouse.get_pos()
+    def debug_keys(self, event):
+        """F3 toggles the profiling overlay, F4 saves the profiling trace."""
+        if event.key == pygame.K_F3:
+            profiler.profiler.toggle_overlay()
+            if self.scene:
+                self.scene.invalidate()
+        elif event.key == pygame.K_F4 and profiler.profiler.enabled:
+            profiler.profiler.write_trace()
+
+    def resize(self, size):
+        """Letterboxes the logical screen into a window of size."""
+        self.display = pygame.display.get_surface()
+        renderer.set_output(self.logical_size, size)
+        self.display.fill(black)
+        pygame.display.update()
+        self.menu_version = None
+        if self.scene:
+            self.scene.invalidate()
+        self.wake()
+
+    def to_logical(self, pos):
+        return renderer.to_logical(pos, self.logical_size)
+
+    def menu_events(self):
+        """Handles input for self.menu; returns False if the state changed."""
+        state = self.state
         for event in pygame.event.get():  # Iterate over the list of events since the last loop.
             if event.type == pygame.QUIT:
                 self.exit()
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE and state == GAME_PAUSED:
+                    self.set_state(GAME_RUNNING)
+                self.debug_keys(event)
+            if event.type == pygame.VIDEORESIZE:
+                self.resize(event.size)
+            if event.type == pygame.MOUSEMOTION:
+                self.menu.hover(self.to_logical(event.pos))
             if event.type == pygame.MOUSEBUTTONDOWN:  # Watch for mouse button presses for button logic.
                 if event.button == 1:  # Left click
-                    for button in self.button_list:
-                        if button.hover(mouse_pos):  # Test the mouse position on each button.
-                            button.press()
-
-        self.display.fill(blue)
-        menuimage = pygame.image.load("data/images/backgrounds/bnhalogo.png").convert()
-        self.display.blit(menuimage,(0, 0))
-        for button in self.button_list:
-            surface, rect = button.get_surface()
-            game.display.blit(surface, rect)
-        pygame.display.update()
+                    self.menu.click(self.to_logical(event.pos))
+            if event.type == pygame.MOUSEBUTTONUP and self.menu is not None:
+                self.menu.release()
+            if self.state != state:
+                return False
+        return True
+
+    def draw_menu(self, background=None):
+        """Presents the menu, but only if its cached surface changed since it was last shown."""
+        with profiler.profiler.phase("compose"):
+            menu_surface, menu_rect = self.menu.get_surface()
+            if self.menu.version == self.menu_version:
+                return
+            if background is not None:
+                self.display.fill(background, renderer.output_rect)
+            target = renderer.to_window(menu_rect, self.logical_size)
+            if target.size != menu_rect.size:
+                # Menus are only redrawn when a button changes, so they are scaled as a whole.
+                menu_surface = pygame.transform.smoothscale(menu_surface, target.size)
+            self.display.blit(menu_surface, target)
+            self.menu_version = self.menu.version
+        with profiler.profiler.phase("present"):
+            pygame.display.update(target)
+
+    def main_menu(self, dt):
+        """function for the main menu interface"""
+        if self.menu_events():
+            self.draw_menu(blue)
 
     def game_update(self, dt):
         """key/click based interface to proceed form events"""
-        mouse_pos = pygame.mouse.get_pos()
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                self.exit()
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    self.game_pause()
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1:
-                    end, new_scene = self.scene.click(mouse_pos)
-                    if end:
-                        try:
-                            self.scene = new_scene
-                            self.scene.step()
-                        except AttributeError:
-                            self.game_mainmenu()
+        with profiler.profiler.phase("input"):
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.exit()
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_ESCAPE:
+                        self.game_pause()
+                    elif event.key == pygame.K_TAB:  # skip what has been read before
+                        end, new_scene = self.scene.skip_read()
+                        if end and not self.change_scene(new_scene):
+                            return
+                    elif event.key == pygame.K_BACKSPACE:
+                        self.scene.roll_back()
+                    self.debug_keys(event)
+                if event.type == pygame.VIDEORESIZE:
+                    self.resize(event.size)
+                if event.type == pygame.MOUSEMOTION:
+                    self.scene.hover(self.to_logical(event.pos))
+                if event.type == pygame.MOUSEWHEEL and event.y > 0:  # scrolling up steps back
+                    self.scene.roll_back()
+                if event.type == pygame.MOUSEBUTTONUP:
+                    self.scene.choice_grid.release()
+                if event.type == pygame.MOUSEBUTTONDOWN:
+                    if event.button == 1:
+                        end, new_scene = self.scene.click(self.to_logical(event.pos))
+                        if end and not self.change_scene(new_scene):
                             return
 
-        self.scene.update(dt)
-
-        self.display.fill((50, 50, 50))
-
-        scene_surface, scene_rect = self.scene.get_surface()
-        self.display.blit(scene_surface, scene_rect)
-
-        pygame.display.update()
+        with profiler.profiler.phase("update"):
+            self.scene.update(dt)
+
+        with profiler.profiler.phase("compose"):
+            scene_surface, scene_rect = self.scene.get_surface()
+            update_rects = []
+            for rect in self.scene.dirty_rects:
+                update_rects.append(self.display.blit(scene_surface, rect.move(scene_rect.topleft), rect))
+            if profiler.profiler.show_overlay:
+                update_rects.append(self.draw_overlay(scene_surface, scene_rect))
+
+        with profiler.profiler.phase("present"):
+            if update_rects:
+                pygame.display.update(update_rects)
+
+    def change_scene(self, new_scene):
+        """Moves on to the scene an ending led to; returns False if it was the last one."""
+        try:
+            self.scene = new_scene
+            self.scene.step()
+        except AttributeError:
+            self.game_mainmenu()
+            return False
+        return True
+
+    def draw_overlay(self, scene_surface, scene_rect):
+        """Draws the profiling overlay over the scene, returning the area to present."""
+        overlay = profiler.profiler.get_overlay([
+            self.scene.renderer.report(),
+            "{0} dirty rects".format(len(self.scene.dirty_rects)),
+        ])
+        rect = overlay.get_rect().union(self.overlay_rect)
+        self.display.blit(scene_surface, rect, rect.move(-scene_rect.x, -scene_rect.y))  # clear the old overlay
+        self.display.blit(overlay, (0, 0))
+        self.overlay_rect = overlay.get_rect()
+        return rect
 
     def pause_menu(self, dt):
-        mouse_pos = pygame.mouse.get_pos()
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                self.exit()
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    self.set_state(GAME_RUNNING)
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                if event.button == 1:
-                    menu_rel_pos = []
-                    for coords in zip(mouse_pos, self.menu.rect.topleft):
-                        menu_rel_pos.append(coords[0] - coords[1])
-                    self.menu.click(menu_rel_pos)
-
-        self.menu.update(dt)
-
-        menu_surface, menu_rect = self.menu.get_surface()
-        self.display.blit(menu_surface, menu_rect)
-
-        pygame.display.update()
+        if self.menu_events():
+            self.menu.update(dt)
+            self.draw_menu()
 
     def set_state(self, state):
+        if state == GAME_RUNNING and self.scene:
+            self.scene.invalidate()  # the pause menu was drawn over the last frame
+        self.menu_version = None
         self.state = state
+        self.wake()
+
+    def wake(self):
+        """Leaves idle mode on the next loop iteration; safe to call from other threads."""
+        self.awake = True
+        pygame.event.post(pygame.event.Event(WAKE_EVENT))
+
+    def is_idle(self):
+        if self.awake:
+            return False
+        if self.state == GAME_RUNNING:
+            return self.scene is not None and not self.scene.is_animating()
+        return True
 
     def loop(self):
         """Keeps the game running"""
         while True:
-            dt = self.clock.tick()
+            if self.is_idle():
+                # Nothing is moving: sleep until input arrives instead of redrawing an identical frame.
+                event = pygame.event.wait(IDLE_TIMEOUT)
+                if event.type == pygame.NOEVENT:
+                    continue
+                pygame.event.post(event)
+            self.awake = False
+
+            dt = min(self.clock.tick(self.fps), MAX_FRAME_TIME)
+            profiler.profiler.begin_frame()
             if self.state == GAME_MAINMENU:
                 self.main_menu(dt)
             if self.state == GAME_RUNNING:
                 self.game_update(dt)
-                pygame.mixer.music.stop()
             if self.state == GAME_PAUSED:
                 self.pause_menu(dt)
+            profiler.profiler.end_frame()
 
-    def game_start(self,x):
-        self.button_list = []
+    def game_start(self, x, slot=None):
         self.menu = None
+        preload.prefetcher.discard()  # anything the previous scene was loading
         self.scene = scenes.Scene(x)
+        self.scene.save_slot = slot if slot is not None else saves.manager.next_slot()
         self.set_state(GAME_RUNNING)
 
     def game_pause(self):
         menu_rect = pygame.Rect((0, 50), (300, 600))
-        menu_rect.centerx = game.display.get_rect().centerx
+        screen_rect = pygame.Rect((0, 0), self.logical_size)
+        menu_rect.centerx = screen_rect.centerx
         self.menu = buttons.Menu(menu_rect, generate_menu_buttons("pause"), "data/images/pause_menu.png")
-        self.menu.rect.center = self.display.get_rect().center
+        self.menu.rect.center = screen_rect.center
         self.set_state(GAME_PAUSED)
 
     def game_mainmenu(self):
+        audio.player.stop_music()
+        preload.prefetcher.discard()
+        readstate.log.flush()
         self.scene = None
-        self.button_list = generate_menu_buttons("main")
+        self.menu = buttons.Menu(pygame.Rect((0, 0), self.logical_size), generate_menu_buttons("main"),
+                                 "data/images/backgrounds/bnhalogo.png")
         self.set_state(GAME_MAINMENU)
 
 
@@ -163,9 +292,9 @@ def generate_menu_buttons(menu):  # Returns a list of buttons for the menu "key"
         button_list.append(start_button)
 
         def load_action():
-            """to load from a saved file"""
-            game.game_start("data/01/save.json")
-            game.scene.step()
+            """to pick a saved slot"""
+            game.menu.set_buttons(generate_menu_buttons("load"))
+            game.wake()
         load_button = buttons.TextButton("Load Game", "data/fonts/Amiko-Bold.ttf")
         load_button.set_pos((550, 600))
         load_button.action = load_action
@@ -182,6 +311,36 @@ def generate_menu_buttons(menu):  # Returns a list of buttons for the menu "key"
         exit_button.active = True
         button_list.append(exit_button)
 
+    elif menu == "load":
+
+        def make_slot_action(slot):
+            def slot_action():
+                """to load from a saved slot"""
+                saves.manager.flush()  # the menu lists saves still queued for the writer
+                game.game_start(saves.manager.slot_path(slot), slot)
+                game.scene.step()
+            return slot_action
+
+        y = 100
+        for slot, entry in saves.manager.slots()[-MAX_SLOTS_SHOWN:]:
+            label = "Slot {0}: {1}  {2}".format(
+                slot, entry["label"], time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["time"])))
+            slot_button = buttons.TextButton(label, "data/fonts/Amiko-Bold.ttf")
+            slot_button.set_pos((200, y))
+            slot_button.action = make_slot_action(slot)
+            slot_button.active = True
+            button_list.append(slot_button)
+            y += 60
+
+        def back_action():
+            game.menu.set_buttons(generate_menu_buttons("main"))
+            game.wake()
+        back_button = buttons.TextButton("Back", "data/fonts/Amiko-Bold.ttf")
+        back_button.set_pos((200, 600))
+        back_button.action = back_action
+        back_button.active = True
+        button_list.append(back_button)
+
     elif menu == "pause":
 
         def continue_action():
@@ -213,7 +372,15 @@ def generate_menu_buttons(menu):  # Returns a list of buttons for the menu "key"
 
 def main():
     global game
-    game = GameObject(1280, 720, "Visual Novel")
+    profiler.profiler.enabled = bool(os.environ.get("VN_PROFILE"))
+    for path in sorted(glob.glob("data/*.vnpak")):
+        assets.mount(path)
+    if os.environ.get("VN_ROLLBACK"):  # steps that can be rolled back, e.g. VN_ROLLBACK=1000
+        rollback.max_steps = int(os.environ["VN_ROLLBACK"])
+    window_size = None
+    if os.environ.get("VN_WINDOW"):  # e.g. VN_WINDOW=1920x1080
+        window_size = tuple(int(side) for side in os.environ["VN_WINDOW"].lower().split("x"))
+    game = GameObject(1280, 720, "Visual Novel", window_size=window_size)
     game.game_mainmenu()
     
     game.loop()